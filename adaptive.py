@@ -0,0 +1,164 @@
+import math
+import numpy as np
+from planner import Plan
+
+
+# two-sided Student t quantile with the coverage of the normal quantile z, for
+# an array of degrees of freedom: exact for 1 and 2, Cornish-Fisher above
+def t_quantile(z, dof):
+    p = 0.5 * (1 + math.erf(z / math.sqrt(2)))
+    dof = np.asarray(dof, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (
+            z
+            + (z**3 + z) / (4 * dof)
+            + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * dof**2)
+            + (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / (384 * dof**3)
+            + (79 * z**9 + 776 * z**7 + 1482 * z**5 - 1920 * z**3 - 945 * z)
+            / (92160 * dof**4)
+        )
+    t = np.where(dof == 2, (2 * p - 1) / math.sqrt(2 * p * (1 - p)), t)
+    return np.where(dof == 1, math.tan(math.pi * (p - 0.5)), t)
+
+
+# Sequential stopping of reps per condition (arm set, rotation, hint) for
+# config["adaptive"] = {"min_reps", "max_reps", "ci_width", "budget", "z",
+# "min_sd"}.
+# Each episode is scored by its mean cumulative proportion of optimal choices,
+# the number bin_hints.compute_ranks averages. Every condition gets min_reps
+# episodes; after that a condition stops once its confidence interval is
+# narrower than ci_width, and the remaining budget (by default the ntrials
+# episodes per condition of a fixed run) goes one rep per round to the open
+# conditions with the widest intervals, up to max_reps each.
+class AdaptiveScheduler:
+    def __init__(self, config):
+        options = config["adaptive"]
+        self.min_reps = options.get("min_reps", 3)
+        self.max_reps = options.get("max_reps", 3 * config["ntrials"])
+        self.ci_width = options.get("ci_width", 0.1)
+        self.z = options.get("z", 1.96)
+        self.min_sd = options.get("min_sd", 0.05)
+        if self.min_reps < 2 or self.max_reps < self.min_reps:
+            raise ValueError("adaptive needs 2 <= min_reps <= max_reps")
+
+        # the grid with room for max_reps reps of every condition
+        self.config = dict(config, ntrials=self.max_reps)
+        self.plan = Plan(self.config)
+        shape = (len(config["arm_means"]), config["narms"], len(config["hints"]))
+        self.shape = shape
+        self.budget = options.get("budget", int(np.prod(shape)) * config["ntrials"])
+
+        # Welford running statistics per condition, and the next rep to run
+        self.n = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.next_rep = np.zeros(shape, dtype=np.int64)
+
+    @property
+    def spent(self):
+        return int(self.n.sum())
+
+    # full width of the confidence interval of every condition, inf below 2 reps.
+    # A t interval, since the first rounds have only a few reps, on a standard
+    # deviation of at least min_sd: a few identical scores have variance 0 and
+    # would otherwise close their condition at min_reps.
+    def widths(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            var = np.maximum(self.m2 / (self.n - 1), self.min_sd**2)
+            width = 2 * t_quantile(self.z, self.n - 1) * np.sqrt(var / self.n)
+        return np.where(self.n >= 2, width, np.inf)
+
+    # score of a finished result row
+    @staticmethod
+    def score(row):
+        history = np.array([-1 if c is None else c for c in row["history"]])
+        # the best arm of every step; rows logged before there was one go by
+        # the arms the episode ended with
+        optimal = row.get("optimal")
+        if optimal is None:
+            optimal = np.argmax(row["arms"]) + 1
+        hits = np.cumsum(history == np.asarray(optimal))
+        return float(np.mean(hits / np.arange(1, len(hits) + 1)))
+
+    def observe(self, row):
+        c = (row["arms_idx"], row["rotation"], row["hint_idx"])
+        x = self.score(row)
+        self.n[c] += 1
+        delta = x - self.mean[c]
+        self.mean[c] += delta / self.n[c]
+        self.m2[c] += delta * (x - self.mean[c])
+        self.next_rep[c] = max(self.next_rep[c], row["rep"] + 1)
+
+    # Plan of the next round: the reps still missing from min_reps first, then
+    # one more rep of the open conditions, widest interval first, as far as the
+    # budget goes. Empty when every condition is done or the budget is spent.
+    def next_round(self):
+        missing = np.maximum(self.min_reps - self.next_rep, 0)
+        if missing.any():
+            counts = missing
+        else:
+            width = self.widths()
+            open_ = (width > self.ci_width) & (self.next_rep < self.max_reps)
+            left = self.budget - self.spent
+            order = np.argsort(-np.where(open_, width, -1), axis=None, kind="stable")
+            order = order[: max(min(int(open_.sum()), left), 0)]
+            counts = np.zeros(self.shape, dtype=np.int64)
+            counts.flat[order] = 1
+
+        index = []
+        for c in zip(*np.nonzero(counts)):
+            a, r, h = (int(i) for i in c)
+            for rep in range(self.next_rep[c], self.next_rep[c] + counts[c]):
+                index.append(self.plan.cell_id((a, r, h, rep)))
+            self.next_rep[c] += counts[c]
+        return self.plan.subset(np.array(sorted(index), dtype=np.int64))
+
+    def summary(self):
+        width = self.widths()
+        done = (width <= self.ci_width).sum()
+        return (
+            f"{self.spent} episodes ({self.spent / self.budget:.0%} of the budget), "
+            f"{done} of {self.n.size} conditions within ci_width {self.ci_width}, "
+            f"reps per condition {self.n.min()}-{self.n.max()}"
+        )
+
+
+# Passes rows on to results and progress, and their scores to the scheduler
+class _Sink:
+    def __init__(self, results, progress, scheduler):
+        self.results = results
+        self.progress = progress
+        self.scheduler = scheduler
+
+    @property
+    def rows(self):
+        return self.results.rows
+
+    def add(self, row):
+        self.results.add(row)
+        if self.progress is not None:
+            key = (row["arms_idx"], row["rotation"], row["hint_idx"], row["rep"])
+            self.progress.record(key, row, rng=True)
+        self.scheduler.observe(row)
+
+
+# Run config with adaptive reps, round by round through run_experiment. Rows
+# are written in the order they finish, so readers go by the condition columns
+# rather than row position. Cells in progress are replayed first.
+def run_adaptive(backend, config, results, progress=None, recorder=None):
+    from run import run_experiment
+
+    scheduler = AdaptiveScheduler(config)
+    sink = _Sink(results, None, scheduler)
+    if progress is not None:
+        for _, row in progress.entries():
+            sink.add(row)
+        progress.restore_rng()
+        sink.progress = progress
+
+    while True:
+        plan = scheduler.next_round()
+        if len(plan) == 0:
+            break
+        run_experiment(backend, scheduler.config, sink, plan=plan, recorder=recorder)
+    return scheduler
@@ -1,14 +1,13 @@
-import os
 import pandas as pd
 import matplotlib.pyplot as plt
-from plot import process_results
+from metrics import load_metrics
+from plot import save
 
 
 # compute proportion optimal action chosen for each arm + hint
 def compute_proportions(config, results):
-    df = process_results(config, results)
-    df["optimal_prop"] = df.groupby("og_idx")["optimal_a"].cumsum() / (df["t"] + 1)
-    df["og_arms"] = df["og_arms"].apply(str)
+    df = load_metrics(config, results).to_long()
+    df["og_arms"] = df["original_arm_values"]
     return df
 
 
@@ -61,61 +60,28 @@ def plot_rankings(ranked_comparison, type):
         # Sort data by rank (or difference) so that the best hint is at the top.
         data = data.sort_values("rank")
 
-        # Create a horizontal bar plot.
-        ax.barh(data["og_hints"], data["difference"], color="skyblue")
+        # Create a horizontal bar plot, with the bootstrap intervals if given.
+        xerr = None
+        if "difference_lo" in data:
+            xerr = [
+                data["difference"] - data["difference_lo"],
+                data["difference_hi"] - data["difference"],
+            ]
+        ax.barh(data["og_hints"], data["difference"], xerr=xerr, color="skyblue")
         ax.set_xlabel("Diff in Optimal Actions")
         ax.set_title(f"Arms: {og_arm}")
 
         # Invert the y-axis to have the highest rank at the top.
         ax.invert_yaxis()
 
-    plt.savefig(f"results/{type}_rankings.png")
-
-
-def get_most_recent_file(partial_str, directory="."):
-    """
-    Searches for files in the given directory whose names contain partial_str.
-    Returns the name of the most recently modified file among them.
-
-    Parameters:
-    - partial_str: The substring to look for in the file names.
-    - directory: The directory in which to search (defaults to the current directory).
-
-    Returns:
-    - The file name of the most recently modified matching file, or None if no match is found.
-    """
-    # List all items in the directory
-    items = os.listdir(directory)
-
-    # Filter items: must be a file and contain the partial string in its name
-    matching_files = [
-        item
-        for item in items
-        if partial_str in item and os.path.isfile(os.path.join(directory, item))
-    ]
-
-    if not matching_files:
-        return None
-
-    # Get the file with the latest modification time
-    most_recent = max(
-        matching_files, key=lambda f: os.path.getmtime(os.path.join(directory, f))
-    )
-
-    print(most_recent)
-    return most_recent
+    save(fig, f"results/{type}_rankings.png")
 
 
+# rankings of the latest run of every bandit config, rendered in parallel
 def main():
-    for type in ["stationary", "drifting", "stepwise", "moving_avg", "time_delayed"]:
-        config = f"config/{type}.json"
-        result = get_most_recent_file(f"{type}_2025", "results")
-        if result:
-            df = compute_proportions(config, f"results/{result}")
-            rankings = compute_ranks(df)
-            plot_rankings(rankings, type)
-        else:
-            print(f"No results found for {type}.")
+    from render import render_all
+
+    render_all(figures=["rankings"])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+import os
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+
+BASELINE = "no hint"
+
+
+# Episodes of every (arm set, hint) cell as a padded index matrix: cells[c, :n[c]]
+# are the episodes of cell c, the rest repeat its first episode and get no weight.
+def cell_index(groups, hints):
+    keys = np.stack([groups, hints], axis=1)
+    cells, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    order = np.argsort(inverse, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    width = counts.max()
+    pos = np.minimum(np.arange(width)[None, :], counts[:, None] - 1)
+    return cells, order[starts[:, None] + pos], counts
+
+
+# (B, cells) bootstrap means of scores, resampling the episodes of every cell
+# with replacement, for one chunk of replicates
+def _resample(scores, index, counts, replicates, seed):
+    rng = np.random.default_rng(seed)
+    width = index.shape[1]
+    # draws past a cell's count are masked out, so every cell uses n[c] draws
+    draw = (rng.random((replicates, len(counts), width)) * counts[None, :, None]).astype(
+        np.int64
+    )
+    values = scores[np.take_along_axis(index[None], draw, axis=2)]
+    mask = np.arange(width)[None, None, :] < counts[None, :, None]
+    return (values * mask).sum(axis=2) / counts
+
+
+# rank of every hint within its arm set, 1 the largest, ties sharing the
+# lowest rank (compute_ranks ranks densely, which only differs on ties); NaN
+# stays NaN. By sorting, so memory stays at the size of diff.
+def _ranks(diff):
+    # descending, NaN sorts last and so does not move the ranks of the rest
+    order = np.argsort(-diff, axis=-1, kind="stable")
+    values = np.take_along_axis(diff, order, axis=-1)
+    pos = np.broadcast_to(np.arange(diff.shape[-1]), diff.shape)
+    new = np.ones(diff.shape, dtype=bool)
+    new[..., 1:] = values[..., 1:] != values[..., :-1]
+    # a tie takes the position of the first of its run
+    first = np.maximum.accumulate(np.where(new, pos, 0), axis=-1)
+    ranks = np.empty(diff.shape)
+    np.put_along_axis(ranks, order, first + 1.0, axis=-1)
+    return np.where(np.isnan(diff), np.nan, ranks)
+
+
+# Bootstrap the hint rankings of a metrics.Metrics: episodes are resampled
+# within each (arm set, hint) cell, replicates at a time in chunks that fit
+# memory_mb, each chunk seeded from seed and its index so results do not
+# depend on workers. Returns the compute_ranks columns with the bootstrap mean
+# rank and the 1 - alpha percentile intervals of the difference from the
+# "no hint" baseline and of the rank.
+def bootstrap_ranks(
+    metrics, replicates=2000, seed=0, alpha=0.05, workers=1, memory_mb=256
+):
+    episodes = metrics.episodes
+    scores = metrics.optimal_prop().mean(axis=1)
+    groups, group_names = pd.factorize(episodes["original_arm_values"])
+    hints, hint_names = pd.factorize(episodes["og_hints"])
+    cells, index, counts = cell_index(groups, hints)
+
+    # float64 draws and values per replicate, plus the mask
+    per_replicate = len(counts) * index.shape[1] * 24
+    chunk = max(1, min(replicates, memory_mb * 2**20 // per_replicate))
+    sizes = [min(chunk, replicates - s) for s in range(0, replicates, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(scores, index, counts, n, s) for n, s in zip(sizes, seeds)]
+    if workers == 1 or len(args) == 1:
+        means = [_resample(*a) for a in args]
+    else:
+        ctx = mp.get_context("spawn")
+        with ProcessPoolExecutor(workers or os.cpu_count(), mp_context=ctx) as pool:
+            means = list(pool.map(_resample, *zip(*args)))
+    means = np.concatenate(means)
+
+    # (B, arm sets, hints), NaN for cells without episodes
+    G, H = len(group_names), len(hint_names)
+    grid = np.full((replicates, G, H), np.nan)
+    grid[:, cells[:, 0], cells[:, 1]] = means
+    point = np.full((G, H), np.nan)
+    mask = np.arange(index.shape[1])[None, :] < counts[:, None]
+    point[cells[:, 0], cells[:, 1]] = (scores[index] * mask).sum(axis=1) / counts
+
+    base = list(hint_names).index(BASELINE) if BASELINE in list(hint_names) else None
+    if base is None:
+        diff, point_diff = np.full_like(grid, np.nan), np.full_like(point, np.nan)
+    else:
+        diff = grid - grid[:, :, base : base + 1]
+        point_diff = point - point[:, base : base + 1]
+    ranks = _ranks(diff)
+
+    q = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+    with np.errstate(all="ignore"):
+        diff_lo, diff_hi = np.nanpercentile(diff, q, axis=0)
+        rank_lo, rank_hi = np.nanpercentile(ranks, q, axis=0)
+        rank_mean = np.nanmean(ranks, axis=0)
+    g, h = cells[:, 0], cells[:, 1]
+    df = pd.DataFrame(
+        {
+            "og_arms": np.asarray(group_names)[g],
+            "og_hints": np.asarray(hint_names)[h],
+            "optimal_prop": point[g, h],
+            "baseline_optimal_prop": point[g, base] if base is not None else np.nan,
+            "difference": point_diff[g, h],
+            "difference_lo": diff_lo[g, h],
+            "difference_hi": diff_hi[g, h],
+            "rank": _ranks(point_diff)[g, h],
+            "rank_mean": rank_mean[g, h],
+            "rank_lo": rank_lo[g, h],
+            "rank_hi": rank_hi[g, h],
+        }
+    )
+    return df.sort_values(["og_arms", "rank"]).reset_index(drop=True)
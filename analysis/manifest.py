@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+
+# index of finished runs, in the directory the experiments are run from
+MANIFEST_PATH = "manifest.sqlite"
+
+# config keys set at run time that do not change the results
+RUNTIME_KEYS = ["quiet", "instrument", "output", "steps_session", "devices", "server"]
+
+COLUMNS = [
+    "path",
+    "bandit",
+    "config_file",
+    "config_hash",
+    "model",
+    "backend",
+    "rows",
+    "shard",
+    "created",
+]
+
+
+def _connect(manifest):
+    db = sqlite3.connect(manifest)
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS runs ("
+        "path TEXT PRIMARY KEY, bandit TEXT, config_file TEXT, config_hash TEXT, "
+        "model TEXT, backend TEXT, rows INTEGER, shard TEXT, created REAL)"
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS runs_bandit ON runs (bandit, created)")
+    return db
+
+
+# hash of the settings of config that determine its results
+def config_hash(config):
+    config = {k: v for k, v in config.items() if k not in RUNTIME_KEYS}
+    text = json.dumps(config, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+# Record a finished results file. Registering a path again (a resumed run)
+# replaces its entry.
+def register_run(path, config, rows, config_file=None, shard="", manifest=MANIFEST_PATH):
+    entry = {
+        "path": os.path.abspath(path),
+        "bandit": config["bandit"],
+        "config_file": config_file,
+        "config_hash": config_hash(config),
+        "model": config.get("model_name"),
+        "backend": config.get("backend", "llm"),
+        "rows": rows,
+        "shard": shard,
+        "created": time.time(),
+    }
+    with _connect(manifest) as db:
+        db.execute(
+            f"INSERT OR REPLACE INTO runs ({', '.join(COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(COLUMNS))})",
+            [entry[c] for c in COLUMNS],
+        )
+    db.close()
+    return entry
+
+
+# Runs matching every given field, newest first. Shard outputs are left out
+# unless shards is set, since their merged file is registered as well.
+def find_runs(manifest=MANIFEST_PATH, shards=False, limit=None, **fields):
+    if not os.path.exists(manifest):
+        return []
+    where = [f"{k} = ?" for k in fields]
+    if not shards:
+        where.append("shard = ''")
+    query = f"SELECT {', '.join(COLUMNS)} FROM runs"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY created DESC"
+    if limit is not None:
+        query += f" LIMIT {int(limit)}"
+
+    db = _connect(manifest)
+    try:
+        rows = db.execute(query, list(fields.values())).fetchall()
+    finally:
+        db.close()
+    # files deleted since they were registered
+    return [dict(zip(COLUMNS, r)) for r in rows if os.path.exists(r[0])]
+
+
+# newest run matching fields, or None
+def latest_run(manifest=MANIFEST_PATH, **fields):
+    runs = find_runs(manifest, **fields)
+    return runs[0] if runs else None
+
+
+# Scan the results files of runs (see find_runs) as one pyarrow dataset,
+# reading only columns and only the row groups whose statistics can match the
+# conditions, column=value or column=[values] on the result columns, e.g.
+# load_runs(runs, hint_idx=0, arms_idx=[0, 2]) or og_hints=text.
+def load_runs(runs, columns=None, **conditions):
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset([r["path"] for r in runs], format="parquet")
+    condition = None
+    for name, values in conditions.items():
+        values = values if isinstance(values, (list, tuple)) else [values]
+        term = ds.field(name).isin(values)
+        condition = term if condition is None else condition & term
+    return dataset.to_table(columns=columns, filter=condition)
+
+
+# register results files from before the manifest:
+#   python analysis/manifest.py config/stationary.json results/stationary_*.parquet
+if __name__ == "__main__":
+    import sys
+    import pyarrow.parquet as pq
+
+    config_file, paths = sys.argv[1], sys.argv[2:]
+    with open(config_file, "r") as f:
+        config = json.load(f)
+    for path in paths:
+        rows = pq.ParquetFile(path).metadata.num_rows
+        register_run(path, config, rows, config_file)
+        print(f"Registered {path} ({rows} rows)")
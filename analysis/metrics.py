@@ -0,0 +1,193 @@
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+# Columns of a results table as numpy arrays. List columns come back as
+# (rows, ...) arrays, history as int8 with -1 for invalid, and dictionary
+# columns as pandas Categoricals over the shared codes. Fixed-size list columns
+# of a memory-mapped Arrow IPC file are views of the mapped file; files of the
+# original layout (version 1) are converted with copies.
+def table_arrays(table):
+    data = {}
+    for name in table.column_names:
+        column = table.column(name)
+        column = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+        if pa.types.is_dictionary(column.type):
+            data[name] = pd.Categorical.from_codes(
+                column.indices.to_numpy(zero_copy_only=False),
+                column.dictionary.to_pylist(),
+            )
+        elif pa.types.is_fixed_size_list(column.type):
+            shape = [len(column)]
+            while pa.types.is_fixed_size_list(column.type):
+                shape.append(column.type.list_size)
+                column = column.flatten()
+            data[name] = column.to_numpy(zero_copy_only=False).reshape(shape)
+        elif pa.types.is_list(column.type):
+            # version 1: variable lists with nulls for invalid answers
+            lengths = pc.list_value_length(column).to_numpy(zero_copy_only=False)
+            if len(column) and (lengths != lengths[0]).any():
+                raise ValueError(f"list column {name} has rows of different lengths")
+            values = column.flatten()
+            if values.null_count:
+                values = pc.fill_null(values, -1)
+            width = int(lengths[0]) if len(column) else 0
+            data[name] = values.to_numpy(zero_copy_only=False).reshape(len(column), width)
+        elif pa.types.is_string(column.type):
+            data[name] = pd.Categorical(column.to_numpy(zero_copy_only=False))
+        else:
+            data[name] = column.to_numpy(zero_copy_only=False)
+    if "history" in data and data["history"].dtype != np.int8:
+        data["history"] = data["history"].astype(np.int8)
+    return data
+
+
+# Columns of a results file as numpy arrays (see table_arrays), opened through
+# a memory map. Arrow IPC files (.arrow, see export_ipc) are read without
+# decoding; parquet is decoded once into one buffer per column.
+def load_results(path, columns=None):
+    if path.endswith(".arrow"):
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        if columns is not None:
+            table = table.select(columns)
+    else:
+        table = pq.read_table(path, columns=columns, memory_map=True)
+    return table_arrays(table)
+
+
+# Write a results file as an uncompressed Arrow IPC file, which load_results
+# maps straight from disk without decoding.
+def export_ipc(path, output):
+    table = pq.read_table(path, memory_map=True).combine_chunks()
+    with pa.OSFile(output, "wb") as f:
+        with pa.ipc.new_file(f, table.schema) as writer:
+            writer.write_table(table)
+
+
+# Metrics of a result file computed on dense arrays: history is the
+# (episodes, T) int8 matrix of 1-based choices, -1 where invalid, arms the
+# (episodes, narms) arm means at the end of each episode, and optimal the
+# (episodes, T) 1-based best arm of every trial, or None for files without it.
+# Long-form rows are only built by to_long.
+class Metrics:
+    def __init__(self, episodes, history, arms, og_arms, optimal=None):
+        self.episodes = episodes
+        self.history = history
+        self.arms = arms
+        self.og_arms = og_arms
+        self._optimal = optimal
+
+    @property
+    def T(self):
+        return self.history.shape[1]
+
+    # (episodes, T) 1-based best arm of every trial; the best of the final
+    # arm means for files written before it was recorded
+    def optimal(self):
+        if self._optimal is not None:
+            return self._optimal
+        best = np.argmax(self.arms, axis=1) + 1
+        return np.broadcast_to(best[:, None], self.history.shape)
+
+    # (episodes, T) whether the best arm was chosen
+    def optimal_a(self):
+        return self.history == self.optimal()
+
+    # (episodes, T) proportion of optimal choices up to and including each trial
+    def optimal_prop(self):
+        return np.cumsum(self.optimal_a(), axis=1) / np.arange(1, self.T + 1)
+
+    # (episodes, T) expected regret of each trial, the best arm mean minus the
+    # chosen arm mean; NaN where the answer was invalid
+    def regret(self):
+        idx = np.clip(self.history.astype(np.int64) - 1, 0, None)
+        chosen = np.take_along_axis(self.arms, idx, axis=1)
+        regret = self.arms.max(axis=1, keepdims=True) - chosen
+        return np.where(self.history > 0, regret, np.nan)
+
+    def cumulative_regret(self):
+        return np.nancumsum(self.regret(), axis=1)
+
+    # mean optimal_prop of every (og_arms, og_hints) condition, the same numbers
+    # bin_hints.compute_ranks groups from the long form
+    def condition_means(self):
+        df = pd.DataFrame(
+            {
+                "og_arms": self.episodes["original_arm_values"].to_numpy(),
+                "og_hints": self.episodes["og_hints"].to_numpy(),
+                "optimal_prop": self.optimal_prop().mean(axis=1),
+                "regret": np.nanmean(self.regret(), axis=1),
+            }
+        )
+        return df.groupby(["og_arms", "og_hints"], sort=False).mean().reset_index()
+
+    # one row per trial, with the columns process_results always returned
+    # (plus optimal_prop), for seaborn
+    def to_long(self):
+        n, T = self.history.shape
+        df = self.episodes.loc[np.repeat(np.arange(n), T)].reset_index(drop=True)
+        df["og_idx"] = np.repeat(np.arange(n), T)
+        df["t"] = np.tile(np.arange(T), n)
+        history = self.history.reshape(-1).astype(object)
+        history[history == -1] = None
+        df["a"] = history
+        df["optimal"] = self.optimal().reshape(-1)
+        df["optimal_a"] = self.optimal_a().reshape(-1)
+        df["optimal_prop"] = self.optimal_prop().reshape(-1)
+        return df
+
+
+# Metrics of a results file, or with conditions (column=value or
+# column=[values], see manifest.load_runs) of the episodes that match them,
+# read through a dataset scan that skips the row groups that cannot match.
+# Arrow IPC files are mapped whole (load_results). The list columns become
+# matrices without a Python object per row.
+def load_metrics(config_path, result_path, **conditions):
+    with open(config_path, "r") as f:
+        config = json.load(f)
+
+    if result_path.endswith(".arrow") and not conditions:
+        data = load_results(result_path)
+    else:
+        from manifest import load_runs
+
+        data = table_arrays(load_runs([{"path": result_path}], **conditions))
+    history = data.pop("history")
+    arms = data.pop("arms")
+    og_arms = data.pop("og_arms")
+    optimal = data.pop("optimal", None)
+    # rows replayed from progress logs without it
+    if optimal is not None and (optimal < 1).any():
+        optimal = None
+    data.pop("probs", None)
+
+    # per-episode columns, with the labels and strings process_results adds
+    episodes = pd.DataFrame(
+        {
+            c: np.asarray(v, dtype=object) if isinstance(v, pd.Categorical) else v
+            for c, v in data.items()
+        }
+    )
+    episodes = episodes.rename(columns={"hint": "agent"})
+    # the first hint of a config is the neutral one, then 5 hints and 5
+    # strategies; files from before the condition columns go by row position
+    labels = np.array(["neutral"] + ["hint"] * 5 + ["strategy"] * 5)
+    hint_idx = episodes["hint_idx"].to_numpy() if "hint_idx" in episodes else None
+    if hint_idx is not None and (hint_idx >= 0).all():
+        episodes["labels"] = labels[hint_idx]
+    else:
+        episodes["labels"] = list(np.repeat(labels, config["ntrials"])) * config["narms"] * 3
+    episodes["str_arms"] = [str(a) for a in arms]
+    episodes["original_arm_values"] = [str(a) for a in og_arms]
+
+    return Metrics(
+        episodes,
+        history,
+        arms.astype(np.float64),
+        og_arms.astype(np.float64),
+        optimal,
+    )
@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from manifest import latest_run, config_hash
+
+
+BANDITS = ["stationary", "drifting", "stepwise", "moving_avg", "time_delayed"]
+
+# curves: results/<bandit>.png, the three arm sets in one figure
+# panels: results/<bandit>_arms<i>.png, one figure per arm set
+# rankings: results/<bandit>_rankings.png, see bin_hints.py
+FIGURES = ["curves", "panels", "rankings"]
+
+
+# Render one kind of figure of one run, with the headless Agg backend and the
+# default settings, whatever figures the process drew before, so the same
+# figure always gives the same bytes. With bootstrap replicates the rankings
+# get confidence intervals (see bootstrap.py), resampled on workers processes.
+def render_figure(config_path, result_path, figure, bootstrap=0, workers=1):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    matplotlib.rcdefaults()
+    from metrics import load_metrics
+    from plot import plot, plot_panels
+    from bin_hints import compute_ranks, plot_rankings
+
+    with open(config_path, "r") as f:
+        config = json.load(f)
+    metrics = load_metrics(config_path, result_path)
+    if figure == "curves":
+        plot(config, metrics.to_long())
+    elif figure == "panels":
+        plot_panels(config, metrics.to_long())
+    elif bootstrap:
+        from bootstrap import bootstrap_ranks
+
+        rankings = bootstrap_ranks(metrics, bootstrap, workers=workers)
+        print(rankings)
+        plot_rankings(rankings, config["bandit"])
+    else:
+        plot_rankings(compute_ranks(metrics.condition_means()), config["bandit"])
+    return f"{config['bandit']} {figure}"
+
+
+# Render figures for the latest run of every bandit config, one task per
+# figure kind of each run on a pool of processes. Each task loads the results
+# it draws from, memory-mapped (see metrics.py). The workers left over when
+# there are fewer tasks than workers go to the bootstrap of the rankings.
+def render_all(bandits=BANDITS, figures=FIGURES, workers=None, bootstrap=0):
+    jobs = []
+    for bandit in bandits:
+        config_path = f"config/{bandit}.json"
+        with open(config_path, "r") as f:
+            run = latest_run(bandit=bandit, config_hash=config_hash(json.load(f)))
+        if run is None:
+            print(f"No results found for {bandit}.")
+            continue
+        jobs += [(config_path, run["path"], figure, bootstrap) for figure in figures]
+    if not jobs:
+        return
+
+    total = workers or os.cpu_count() or 1
+    workers = min(total, len(jobs))
+    jobs = [job + (max(1, total // workers),) for job in jobs]
+    start = time.perf_counter()
+    if workers == 1:
+        for job in jobs:
+            print(f"Rendered {render_figure(*job)}")
+    else:
+        ctx = mp.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=ctx) as pool:
+            for name in pool.map(render_figure, *zip(*jobs)):
+                print(f"Rendered {name}")
+    print(f"Rendered {len(jobs)} figures in {time.perf_counter() - start:.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bandits", nargs="+", default=BANDITS)
+    parser.add_argument("--figures", nargs="+", choices=FIGURES, default=FIGURES)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--bootstrap",
+        type=int,
+        default=0,
+        help="bootstrap replicates for confidence intervals on the rankings",
+    )
+    args = parser.parse_args()
+    render_all(args.bandits, args.figures, args.workers, args.bootstrap)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import re
+import time
+import numpy as np
+from config.constants import MAIN_TEXT
+from mab import make_instruction, parse_choice
+
+
+# Backend protocol used by MAB, run_batch and run_experiment. A backend plays a
+# batch of episodes (cells of planner.Plan) in lockstep:
+#   needs_prompts          whether choose needs the prompt text of each episode
+#   reset(episodes)        start new episodes
+#   choose(prompts)        -> (1-based arm per episode, None where the answer
+#                          was not a number; (E, narms) probabilities or None)
+#   observe(arms, rewards) 0-based arms pulled and the rewards received
+#   overlap                whether choose can serve several groups of episodes
+#                          in turn (batch.run_overlapped); optionally with
+#                          encode(episodes, prompts) -> one group's input for
+#                          choose_encoded(inputs), holding all of its state
+# The LLM backends are below, the vectorized classical agents in policies.py.
+
+
+# text-generation pipeline, one prompt at a time
+class PipelineBackend:
+    needs_prompts = True
+    overlap = True
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+
+    def count_tokens(self, prompt):
+        return len(self.pipe.tokenizer(prompt)["input_ids"])
+
+    def reset(self, episodes):
+        pass
+
+    def choose(self, prompts):
+        choices = [
+            parse_choice(self.pipe(p)[0]["generated_text"][len(p) :]) for p in prompts
+        ]
+        return choices, None
+
+    def observe(self, arms, rewards):
+        pass
+
+
+# one episode at a time through an EpisodeSession's KV cache, generating the
+# answer or, with scoring, sampling it from the arm label probabilities
+class SessionBackend:
+    needs_prompts = True
+    overlap = False
+
+    def __init__(self, session, scoring=False):
+        self.session = session
+        self.scoring = scoring
+
+    def count_tokens(self, prompt):
+        return len(self.session.tokenizer(prompt)["input_ids"])
+
+    def reset(self, episodes):
+        if len(episodes) != 1:
+            raise ValueError("SessionBackend plays one episode at a time")
+        self.narms = len(episodes[0].arms)
+        # the task text and the hint are shared by many episodes
+        if self.session.prefix_cache is not None:
+            self.session.prefill(MAIN_TEXT)
+            self.session.prefill(make_instruction(episodes[0].hint))
+
+    def choose(self, prompts):
+        (prompt,) = prompts
+        if self.scoring:
+            choice, probs = self.session.score(prompt, self.narms)
+            return [choice], np.array([probs])
+        return [parse_choice(self.session.generate(prompt))], None
+
+    def observe(self, arms, rewards):
+        pass
+
+
+# all episodes in one padded forward pass per step, see batch.py
+class BatchedBackend:
+    needs_prompts = True
+    overlap = True
+
+    def __init__(self, pipe, config):
+        self.pipe = pipe
+        self.config = config
+
+    def count_tokens(self, prompt):
+        return len(self.pipe.tokenizer(prompt)["input_ids"])
+
+    def reset(self, episodes):
+        self.episodes = episodes
+
+    # the tokenized prompts of a group of episodes with the arm count and token
+    # budget of that group, so several groups can be in flight at once
+    def encode(self, episodes, prompts):
+        from batch import max_batch_tokens
+
+        return {
+            "ids": [self.pipe.tokenizer(p)["input_ids"] for p in prompts],
+            "narms": len(episodes[0].arms),
+            "max_tokens": max_batch_tokens(self.config, len(episodes)),
+        }
+
+    def choose(self, prompts):
+        return self.choose_encoded(self.encode(self.episodes, prompts))
+
+    def choose_encoded(self, inputs):
+        from batch import choose_batch
+
+        choices, probs = choose_batch(
+            self.pipe,
+            inputs["ids"],
+            inputs["narms"],
+            self.config["temperature"],
+            self.config.get("scoring", False),
+            inputs["max_tokens"],
+        )
+        return choices, np.array(probs) if self.config.get("scoring", False) else None
+
+    def observe(self, arms, rewards):
+        pass
+
+
+# Deterministic stand-in for the language model, for benchmarks and protocol
+# tests without a GPU. Tokens are words and punctuation marks. With cache, only
+# the tokens after the prefix shared with the previous prompt of the same
+# episode count as prefilled, as with EpisodeSession. Answers are drawn from a
+# seeded generator, with a share of invalid ones that are not a number, and
+# token_cost seconds of sleep per prefilled token stand in for the forward pass.
+class FakeBackend:
+    needs_prompts = True
+    TOKEN = re.compile(r"\w+|[^\w\s]")
+
+    def __init__(self, seed=0, cache=False, invalid=0.0, token_cost=0.0):
+        self.rng = np.random.default_rng(seed)
+        self.cache = cache
+        self.invalid = invalid
+        self.token_cost = token_cost
+        self.prompt_tokens = 0
+        self.prefilled = 0
+        self.parse_s = 0.0
+
+    def seed(self, seed):
+        self.rng = np.random.default_rng(seed)
+
+    # the cached prefix of an episode is tracked by its position in the batch
+    @property
+    def overlap(self):
+        return not self.cache
+
+    def reset(self, episodes):
+        self.narms = len(episodes[0].arms)
+        self.last = [[] for _ in episodes]
+
+    def tokenize(self, text):
+        return self.TOKEN.findall(text)
+
+    def count_tokens(self, prompt):
+        return len(self.tokenize(prompt))
+
+    # raw answer text per prompt, as a text-generation model would give it
+    def generate(self, prompts):
+        prefilled = 0
+        for i, prompt in enumerate(prompts):
+            ids = self.tokenize(prompt)
+            n = 0
+            if self.cache:
+                for a, b in zip(self.last[i], ids):
+                    if a != b:
+                        break
+                    n += 1
+                self.last[i] = ids
+            self.prompt_tokens += len(ids)
+            prefilled += len(ids) - n
+        self.prefilled += prefilled
+        if self.token_cost:
+            time.sleep(self.token_cost * prefilled)
+
+        choices = self.rng.integers(1, self.narms + 1, len(prompts))
+        invalid = self.rng.random(len(prompts)) < self.invalid
+        return ["x" if bad else str(c) for c, bad in zip(choices, invalid)]
+
+    # parse_s sums the time spent parsing the answers, for bench.py
+    def choose(self, prompts):
+        texts = self.generate(prompts)
+        t0 = time.perf_counter()
+        choices = [parse_choice(t) for t in texts]
+        self.parse_s += time.perf_counter() - t0
+        return choices, None
+
+    def observe(self, arms, rewards):
+        pass
+
+
+# Sends every step to an inference server shared with other runs (server.py)
+# over its Unix socket, which batches it with the steps of the other clients.
+# The server has to run config["model_name"]. Every prompt carries the seed of
+# its cell and its step, since the model samples on the server. No KV cache is
+# kept on either side, so every step prefills the whole prompt.
+class RemoteBackend:
+    needs_prompts = True
+    overlap = True
+
+    def __init__(self, path, config):
+        import socket
+        from server import send_message, recv_message
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        send_message(self.sock, {"hello": config["model_name"]})
+        reply = recv_message(self.sock)
+        if "error" in reply:
+            raise RuntimeError("inference server refused: " + reply["error"])
+        self.temperature = config["temperature"]
+        self.scoring = config.get("scoring", False)
+        # steps sent per cell_id, run_overlapped resets the backend every step
+        self.steps = {}
+
+    def reset(self, episodes):
+        self.episodes = episodes
+        self.narms = len(episodes[0].arms)
+
+    def choose(self, prompts):
+        from server import send_message, recv_message
+
+        seeds = []
+        for cell in self.episodes:
+            step = self.steps.get(cell.cell_id, 0)
+            self.steps[cell.cell_id] = step + 1
+            seeds.append([int(cell.seed), step])
+        send_message(
+            self.sock,
+            {
+                "prompts": prompts,
+                "seeds": seeds,
+                "narms": self.narms,
+                "temperature": self.temperature,
+                "scoring": self.scoring,
+            },
+        )
+        reply = recv_message(self.sock)
+        if "error" in reply:
+            raise RuntimeError("inference server failed: " + reply["error"])
+        probs = reply["probs"]
+        return reply["choices"], np.array(probs) if probs is not None else None
+
+    def observe(self, arms, rewards):
+        pass
+
+
+# backend for config["backend"]: "llm" (default) wraps pipe according to the
+# batch_size, kv_cache, prefix_cache_mb and scoring keys, or is a RemoteBackend
+# when config["server"] names an inference server's socket; "fake" is
+# FakeBackend and any other name is one of the agents in policies.py. Only a
+# local "llm" needs pipe.
+def make_backend(config, pipe=None):
+    name = config.get("backend", "llm")
+    if name == "fake":
+        return FakeBackend(**config.get("agent", {}))
+    if name == "llm" and "server" in config:
+        if config.get("kv_cache", False) or "prefix_cache_mb" in config:
+            raise ValueError("kv_cache and prefix_cache_mb are not available with --server")
+        return RemoteBackend(config["server"], config)
+    if name != "llm":
+        from policies import make_agent
+
+        return make_agent(config)
+
+    if config.get("batch_size", 1) > 1:
+        return BatchedBackend(pipe, config)
+
+    scoring = config.get("scoring", False)
+    prefix_cache = None
+    if "prefix_cache_mb" in config:
+        from prefix_cache import PrefixCache
+
+        prefix_cache = PrefixCache(config["prefix_cache_mb"] * 2**20)
+    if config.get("kv_cache", False) or prefix_cache is not None or scoring:
+        from session import EpisodeSession
+
+        session = EpisodeSession(
+            pipe.model, pipe.tokenizer, config["temperature"], prefix_cache
+        )
+        return SessionBackend(session, scoring)
+
+    return PipelineBackend(pipe)
+
+
+# whether config runs a language model, and so needs one loaded
+def uses_model(config):
+    return config.get("backend", "llm") == "llm" and "server" not in config
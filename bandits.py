@@ -7,6 +7,12 @@ class stationary_MAB:
         self.narms = None
         self.means = None
         self.stds = None
+        self.trajectory = None
+        self.trajectory_step = 0
+        # np.random.RandomState of this instance, None for the global stream
+        self.rng = None
+        # 1-based best arm of every step of the episode, by the means it drew from
+        self.optimal_path = []
 
     def set_narms(self, n):
         self.narms = n
@@ -17,8 +23,38 @@ class stationary_MAB:
     def set_stds(self, stds):
         self.stds = np.array(stds, dtype=int)
 
+    # draw from rng instead of the global stream, for episodes that run side
+    # by side (batch.py) and so cannot share it
+    def set_rng(self, rng):
+        self.rng = rng
+
+    def _random(self):
+        return np.random if self.rng is None else self.rng
+
+    # replay precomputed reward draws (see trajectories.py) instead of sampling
+    def set_trajectory(self, trajectory):
+        self.trajectory = trajectory
+        self.trajectory_step = 0
+
+    # clear any state carried between steps, called at the start of each episode
+    def reset(self):
+        self.trajectory_step = 0
+        self.optimal_path = []
+
+    # path of the arm means over T steps of one episode, (T, narms)
+    def mean_path(self, T, rng):
+        return np.broadcast_to(np.array(self.means, dtype=float), (T, self.narms))
+
+    def _draw(self, a):
+        self.optimal_path.append(int(np.argmax(self.means)) + 1)
+        if self.trajectory is None:
+            return self._random().normal(self.means[a], self.stds[a], 1)[0]
+        r = self.trajectory.rewards[self.trajectory_step, a]
+        self.trajectory_step += 1
+        return float(r)
+
     def get_reward(self, a):
-        return np.random.normal(self.means[a], self.stds[a], 1)[0]
+        return self._draw(a)
 
 
 ######## ALL REMAINING BANDITS INHERIT FROM STATIONARY MAB ########
@@ -33,10 +69,17 @@ class drifting_MAB(stationary_MAB):
     def set_drift_rate(self, rate):
         self.drift_rate = rate
 
+    def mean_path(self, T, rng):
+        drift = rng.normal(0, self.drift_rate, (T, self.narms))
+        return np.array(self.means, dtype=float) + np.cumsum(drift, axis=0)
+
     def get_reward(self, a):
+        if self.trajectory is not None:
+            self.means = self.trajectory.means[self.trajectory_step]
+            return self._draw(a)
         self.means = self.means.astype(float)
-        self.means += np.random.normal(0, self.drift_rate, self.narms)
-        return np.random.normal(self.means[a], self.stds[a], 1)[0]
+        self.means += self._random().normal(0, self.drift_rate, self.narms)
+        return self._draw(a)
 
 
 # non-stationary multi-armed bandit (stepwise)
@@ -45,17 +88,39 @@ class stepwise_MAB(stationary_MAB):
         super().__init__()
         self.stepper = 0
         self.change = change_step
+        # (means before the first change, means after the last), so that reset
+        # can undo the changes unless new means were set in between
+        self.changed = None
 
     def set_change_step(self, step):
         self.change = step
 
+    def reset(self):
+        super().reset()
+        self.stepper = 0
+        if self.changed is not None and self.means is self.changed[1]:
+            self.means = self.changed[0]
+        self.changed = None
+
+    # within one episode, the change happens at step change and persists
+    def mean_path(self, T, rng):
+        path = np.tile(np.array(self.means, dtype=float), (T, 1))
+        path[self.change - 1 :] = np.trunc(path[self.change - 1 :])
+        path[self.change - 1 :, 0 : self.narms // 2] = 0
+        return path
+
     def get_reward(self, a):
+        if self.trajectory is not None:
+            self.means = self.trajectory.means[self.trajectory_step]
+            return self._draw(a)
         # at step change, set the means of the first half of the arms to 0
         self.stepper += 1
         if self.stepper % self.change == 0:
+            initial = self.means if self.changed is None else self.changed[0]
             self.means = np.array(self.means, dtype=int)
             self.means[0 : self.narms // 2] = 0
-        return np.random.normal(self.means[a], self.stds[a], 1)[0]
+            self.changed = (initial, self.means)
+        return self._draw(a)
 
 
 # 2-context multi-armed bandit
@@ -64,7 +129,7 @@ class two_context_MAB(stationary_MAB):
         # if state 2, flip the means
         if not c:
             self.means = -self.means
-        return np.random.normal(self.means[a], self.stds[a], 1)[0]
+        return self._random().normal(self.means[a], self.stds[a], 1)[0]
 
 
 # 3-context multi-armed bandit
@@ -78,22 +143,29 @@ class three_context_MAB(stationary_MAB):
             self.means = np.sort(self.means)[::-1]
         # if state 2, randomly sort means
         else:
-            np.random.shuffle(self.means)
+            self._random().shuffle(self.means)
 
-        return np.random.normal(self.means[a], self.stds[a], 1)[0]
+        return self._random().normal(self.means[a], self.stds[a], 1)[0]
 
 
 # moving average multi-armed bandit
 class moving_avg_MAB(stationary_MAB):
     def __init__(self):
         super().__init__()
-        self.rewards = []
+        self.total = 0.0
+        self.count = 0
+
+    def reset(self):
+        super().reset()
+        self.total = 0.0
+        self.count = 0
 
     def get_reward(self, a):
-        r = np.random.normal(self.means[a], self.stds[a], 1)[0]
-        self.rewards.append(r)
+        r = self._draw(a)
+        self.total += r
+        self.count += 1
         # return average of previous rewards
-        return np.mean(self.rewards)
+        return self.total / self.count
 
 
 # time-delayed multi-armed bandit
@@ -101,15 +173,167 @@ class time_delayed_MAB(stationary_MAB):
     def __init__(self, delay=3):
         super().__init__()
         self.delay = delay
-        self.rewards = []
+        self.reset()
+
+    def reset(self):
+        super().reset()
+        # ring buffer holding the last delay rewards
+        self.rewards = [0.0] * max(self.delay, 1)
+        self.t = 0
 
     def get_reward(self, a):
-        r = np.random.normal(self.means[a], self.stds[a], 1)[0]
-        self.rewards.append(r)
-        if len(self.rewards) < self.delay:
+        r = self._draw(a)
+        size = len(self.rewards)
+        self.rewards[self.t % size] = r
+        self.t += 1
+        # the reward drawn delay - 1 steps ago, 0 until there is one
+        if self.t < self.delay:
             return 0
         else:
-            return self.rewards.pop(0)
+            return self.rewards[(self.t - size) % size]
+
+
+######## BATCHED BANDITS: E ENVIRONMENTS STEPPED WITH ONE CALL ########
+# means and stds are (E, narms), step takes one action index per environment and
+# returns one reward per environment, drawn from a seeded np.random.Generator
+# or, with set_rng, from a streams.EpisodeStreams
+
+
+# stationary multi-armed bandit, batched
+class stationary_BatchMAB:
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.narms = None
+        self.means = None
+        self.stds = None
+        self.nenvs = None
+        self._envs = None
+        self._std_values = None
+        # (E,) 1-based best arms of every step, see optimal_matrix
+        self.optimal_path = []
+
+    def set_narms(self, n):
+        self.narms = n
+
+    def set_rng(self, rng):
+        self.rng = rng
+
+    # arms is (E, narms), or (narms,) for a single environment
+    def set_means(self, arms):
+        self.means = np.array(arms, dtype=float, ndmin=2)
+        self.nenvs = self.means.shape[0]
+        self._envs = np.arange(self.nenvs)
+        if self._std_values is not None:
+            self.set_stds(self._std_values)
+
+    # stds is (E, narms) or (narms,) shared by all environments
+    def set_stds(self, stds):
+        self._std_values = stds
+        stds = np.array(stds, dtype=float, ndmin=2)
+        if self.nenvs is not None:
+            stds = np.broadcast_to(stds, (self.nenvs, stds.shape[-1]))
+        self.stds = stds
+
+    def reset(self):
+        self.optimal_path = []
+
+    # (E, T) int8 1-based best arm of every environment and step so far
+    def optimal_matrix(self):
+        return np.stack(self.optimal_path, axis=1).astype(np.int8)
+
+    def _draw(self, actions):
+        self.optimal_path.append(np.argmax(self.means, axis=1) + 1)
+        actions = np.asarray(actions)
+        mu = self.means[self._envs, actions]
+        sd = self.stds[self._envs, actions]
+        return mu + sd * self.rng.standard_normal(self.nenvs)
+
+    def step(self, actions):
+        return self._draw(actions)
+
+
+# non-stationary multi-armed bandit (drifting), batched
+class drifting_BatchMAB(stationary_BatchMAB):
+    def __init__(self, seed=None, drift_rate=2):
+        super().__init__(seed)
+        self.drift_rate = drift_rate
+
+    def set_drift_rate(self, rate):
+        self.drift_rate = rate
+
+    def step(self, actions):
+        self.means += self.rng.normal(0, self.drift_rate, self.means.shape)
+        return self._draw(actions)
+
+
+# non-stationary multi-armed bandit (stepwise), batched
+class stepwise_BatchMAB(stationary_BatchMAB):
+    def __init__(self, seed=None, change_step=10):
+        super().__init__(seed)
+        self.stepper = 0
+        self.change = change_step
+
+    def set_change_step(self, step):
+        self.change = step
+
+    def reset(self):
+        super().reset()
+        self.stepper = 0
+
+    def step(self, actions):
+        # at step change, set the means of the first half of the arms to 0
+        # (truncated to int like the scalar version)
+        self.stepper += 1
+        if self.stepper % self.change == 0:
+            np.trunc(self.means, out=self.means)
+            self.means[:, 0 : self.narms // 2] = 0
+        return self._draw(actions)
+
+
+# moving average multi-armed bandit, batched
+class moving_avg_BatchMAB(stationary_BatchMAB):
+    def __init__(self, seed=None):
+        super().__init__(seed)
+        self.total = None
+        self.count = 0
+
+    def reset(self):
+        super().reset()
+        self.total = np.zeros(self.nenvs)
+        self.count = 0
+
+    def step(self, actions):
+        if self.total is None or len(self.total) != self.nenvs:
+            self.reset()
+        self.total += self._draw(actions)
+        self.count += 1
+        # return average of previous rewards
+        return self.total / self.count
+
+
+# time-delayed multi-armed bandit, batched
+class time_delayed_BatchMAB(stationary_BatchMAB):
+    def __init__(self, seed=None, delay=3):
+        super().__init__(seed)
+        self.delay = delay
+        self.buffer = None
+        self.t = 0
+
+    def reset(self):
+        super().reset()
+        self.buffer = np.zeros((self.nenvs, max(self.delay, 1)))
+        self.t = 0
+
+    def step(self, actions):
+        if self.buffer is None or len(self.buffer) != self.nenvs:
+            self.reset()
+        size = self.buffer.shape[1]
+        self.buffer[:, self.t % size] = self._draw(actions)
+        self.t += 1
+        # the reward drawn delay - 1 steps ago, 0 until there is one
+        if self.t < self.delay:
+            return np.zeros(self.nenvs)
+        return self.buffer[:, (self.t - size) % size].copy()
 
 
 def main():
@@ -159,6 +383,22 @@ def main():
         print(bandit.get_reward(i % 4))
         print(bandit.means)
 
+    print("\nbatched")
+    for cls in [
+        stationary_BatchMAB,
+        drifting_BatchMAB,
+        stepwise_BatchMAB,
+        moving_avg_BatchMAB,
+        time_delayed_BatchMAB,
+    ]:
+        print(cls.__name__)
+        bandit = cls(seed=0)
+        bandit.set_narms(4)
+        bandit.set_means([[10, 20, 30, 40], [40, 30, 20, 10]])
+        bandit.set_stds([4, 4, 4, 4])
+        for i in range(20):
+            print(bandit.step([i % 4, (i + 1) % 4]))
+
 
 if __name__ == "__main__":
     main()
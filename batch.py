@@ -0,0 +1,259 @@
+import time
+import queue
+import random
+import threading
+import numpy as np
+from config.constants import QUESTION, N_ITERS, MAX_SEQ_LENGTH
+from mab import make_instruction, make_context, parse_choice
+
+
+# left-pad token id lists into a batch, with position ids that skip the padding
+def _pad(batch_ids, pad_id, device):
+    import torch
+
+    width = max(len(ids) for ids in batch_ids)
+    input_ids = torch.full((len(batch_ids), width), pad_id, dtype=torch.long)
+    mask = torch.zeros((len(batch_ids), width), dtype=torch.long)
+    for i, ids in enumerate(batch_ids):
+        input_ids[i, width - len(ids) :] = torch.tensor(ids)
+        mask[i, width - len(ids) :] = 1
+    positions = (mask.cumsum(-1) - 1).clamp(min=0)
+    return input_ids.to(device), mask.to(device), positions.to(device)
+
+
+# one padded forward pass (or one-token generate) for a chunk of prompts,
+# returns the 1-based choices (None if unparseable) and the arm probabilities
+def _choose_chunk(pipe, batch_ids, narms, temperature, scoring):
+    import torch
+    from session import arm_token_ids, sample_arms
+
+    model, tokenizer = pipe.model, pipe.tokenizer
+    input_ids, mask, positions = _pad(batch_ids, 0, model.device)
+
+    with torch.no_grad():
+        if scoring:
+            out = model(input_ids=input_ids, attention_mask=mask, position_ids=positions)
+            arm_ids = arm_token_ids(tokenizer, narms)
+            choices, probs = sample_arms(out.logits[:, -1, arm_ids], temperature)
+            return choices, probs.tolist()
+
+        out = model.generate(
+            input_ids=input_ids,
+            attention_mask=mask,
+            pad_token_id=0,
+            do_sample=True,
+            temperature=temperature,
+            max_new_tokens=1,
+        )
+    texts = tokenizer.batch_decode(out[:, -1:], skip_special_tokens=True)
+    return [parse_choice(t) for t in texts], [None] * len(texts)
+
+
+# split the prompts into chunks whose padded size stays within max_tokens, and
+# halve a chunk again if it still runs out of memory
+def choose_batch(pipe, batch_ids, narms, temperature, scoring, max_tokens):
+    import torch
+
+    for ids in batch_ids:
+        if len(ids) > MAX_SEQ_LENGTH:
+            raise ValueError(
+                f"prompt of {len(ids)} tokens exceeds max_seq_length {MAX_SEQ_LENGTH}"
+            )
+
+    chunks = []
+    chunk = []
+    width = 0
+    for ids in batch_ids:
+        width_next = max(width, len(ids))
+        if chunk and (len(chunk) + 1) * width_next > max_tokens:
+            chunks.append(chunk)
+            chunk, width_next = [], len(ids)
+        chunk.append(ids)
+        width = width_next
+    chunks.append(chunk)
+
+    choices, probs = [], []
+    while chunks:
+        chunk = chunks.pop(0)
+        try:
+            c, p = _choose_chunk(pipe, chunk, narms, temperature, scoring)
+        except torch.cuda.OutOfMemoryError:
+            if len(chunk) == 1:
+                raise
+            torch.cuda.empty_cache()
+            half = len(chunk) // 2
+            chunks[:0] = [chunk[:half], chunk[half:]]
+            continue
+        choices += c
+        probs += p
+    return choices, probs
+
+
+# padded tokens allowed in one forward pass
+def max_batch_tokens(config, nepisodes):
+    return config.get(
+        "max_batch_tokens", config.get("batch_size", nepisodes) * MAX_SEQ_LENGTH // 4
+    )
+
+
+# Lockstep state of a group of episodes, each a (cell, bandit) pair with its
+# own bandit instance: the prompts of the next step, and the environment step
+# once the backend has chosen. Each episode draws its rewards and its random
+# arms for invalid answers from streams seeded by its own cell, the same
+# draws as when MAB plays it alone, so they do not depend on which episodes
+# share the batch.
+class _Group:
+    def __init__(self, backend, episodes, config, recorder):
+        self.backend = backend
+        self.episodes = episodes
+        self.recorder = recorder
+        self.cells = [cell for cell, _ in episodes]
+        self.narms = episodes[0][1].narms
+        self.step = 0
+
+        self.instructions = [make_instruction(cell.hint) for cell in self.cells]
+        self.contexts = [make_context(config, self.narms) for _ in episodes]
+        self.hists = [[] for _ in episodes]
+        self.probs = [[] for _ in episodes]
+        self.arm_counts = [[0] * self.narms for _ in episodes]
+        self.rngs = [random.Random(cell.seed) for cell in self.cells]
+        for cell, bandit in episodes:
+            bandit.set_rng(np.random.RandomState(cell.seed))
+            bandit.reset()
+
+    def prompts(self):
+        if not self.backend.needs_prompts:
+            return [None] * len(self.episodes)
+        return [
+            instruction + context.text() + QUESTION
+            for instruction, context in zip(self.instructions, self.contexts)
+        ]
+
+    # pull the chosen arms, a random one where the answer was invalid
+    def advance(self, prompts, choices, step_probs, inference_s):
+        chosen, rewards = [], []
+        for i, (_, bandit) in enumerate(self.episodes):
+            choice = choices[i]
+            valid = choice is not None and 1 <= choice <= self.narms
+            if valid:
+                self.hists[i].append(int(choice))
+                chosen_idx = int(choice) - 1
+            else:
+                self.hists[i].append(None)
+                chosen_idx = self.rngs[i].randint(0, self.narms - 1)
+
+            if step_probs is not None:
+                self.probs[i].append(step_probs[i].tolist())
+
+            t1 = time.perf_counter()
+            reward = bandit.get_reward(chosen_idx)
+            if self.recorder is not None:
+                reward_s = time.perf_counter() - t1
+                self.recorder.record(
+                    self.cells[i], self.step, prompts[i], inference_s, not valid, reward_s
+                )
+            self.arm_counts[i][chosen_idx] += 1
+            self.contexts[i].add(self.step, choice, chosen_idx, reward)
+            chosen.append(chosen_idx)
+            rewards.append(reward)
+        self.backend.observe(chosen, rewards)
+        self.step += 1
+
+    def outputs(self, config):
+        if not config.get("quiet", False):
+            for (_, bandit), counts in zip(self.episodes, self.arm_counts):
+                print(f"Total Arm Counts :{counts}")
+                print(f"Actual Arm Means: {bandit.means}")
+        return list(zip(self.hists, self.probs))
+
+
+# Run several MAB experiments in lockstep, one backend.choose call per step.
+# episodes is a list of (cell, bandit) pairs, each with its own bandit instance;
+# returns one (hist, probs) pair per episode, as MAB does. With a recorder, the
+# latency of the batched call is split evenly over its episodes.
+def run_batch(backend, episodes, config, recorder=None):
+    group = _Group(backend, episodes, config, recorder)
+    backend.reset(group.cells)
+
+    for _ in range(config.get("n_iters", N_ITERS)):
+        prompts = group.prompts()
+        t0 = time.perf_counter()
+        choices, step_probs = backend.choose(prompts)
+        inference_s = (time.perf_counter() - t0) / len(episodes)
+        group.advance(prompts, choices, step_probs, inference_s)
+
+    return group.outputs(config)
+
+
+# Run several groups of lockstep episodes (lists of (cell, bandit) pairs) with
+# inference overlapped with the CPU work: one thread runs the backend on the
+# groups whose prompts are ready while this one steps the environments of the
+# others and builds their next prompts. At most depth groups wait for
+# inference, so prompt building cannot run ahead of the model. Groups are
+# served in the order they become ready, which for a given set of groups is
+# always the same. Needs a backend that allows it (overlap). A backend with
+# encode(episodes, prompts) gets each group's input, tokenized on this thread
+# and carrying everything choose_encoded needs; any other backend is reset to
+# the group before each of its choose calls on the inference thread.
+# Returns the outputs of every group, as run_batch does.
+def run_overlapped(backend, groups, config, recorder=None, depth=2):
+    n_iters = config.get("n_iters", N_ITERS)
+    states = [_Group(backend, episodes, config, recorder) for episodes in groups]
+    encode = getattr(backend, "encode", None)
+    ready = queue.Queue(maxsize=depth)
+    done = queue.Queue()
+
+    def infer():
+        failed = False
+        while True:
+            item = ready.get()
+            if item is None:
+                return
+            # after a failure keep taking work so that submit never blocks
+            if failed:
+                continue
+            g, prompts, inputs = item
+            try:
+                t0 = time.perf_counter()
+                if encode is not None:
+                    choices, step_probs = backend.choose_encoded(inputs)
+                else:
+                    backend.reset(states[g].cells)
+                    choices, step_probs = backend.choose(prompts)
+                done.put((g, prompts, choices, step_probs, time.perf_counter() - t0))
+            except BaseException as e:
+                done.put((g, prompts, e, None, 0.0))
+                failed = True
+
+    def submit(g):
+        prompts = states[g].prompts()
+        inputs = encode(states[g].cells, prompts) if encode is not None else None
+        ready.put((g, prompts, inputs))
+
+    thread = threading.Thread(target=infer, daemon=True)
+    thread.start()
+    try:
+        for g in range(len(states)):
+            submit(g)
+        active = len(states)
+        while active:
+            g, prompts, choices, step_probs, seconds = done.get()
+            if isinstance(choices, BaseException):
+                raise choices
+            state = states[g]
+            state.advance(prompts, choices, step_probs, seconds / len(state.episodes))
+            if state.step < n_iters:
+                submit(g)
+            else:
+                active -= 1
+    finally:
+        # drop waiting work so the stop signal fits in the queue
+        while True:
+            try:
+                ready.get_nowait()
+            except queue.Empty:
+                break
+        ready.put(None)
+        thread.join()
+
+    return [state.outputs(config) for state in states]
@@ -0,0 +1,205 @@
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import multiprocessing as mp
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from config.constants import N_ITERS
+from mab import MAB, make_context
+from batch import run_batch
+from planner import Plan
+from progress import seed_rngs
+from backends import FakeBackend
+import bandits
+
+
+BANDITS = ["stationary", "drifting", "stepwise", "moving_avg", "time_delayed"]
+
+# fields that identify a case when comparing against a baseline
+CASE_KEYS = ["bandit", "hint_length", "batch_size", "n_iters", "cache", "context"]
+# value of keys added since older baselines were written
+CASE_DEFAULTS = {"context": "full"}
+
+
+# Sums the step costs that MAB and run_batch report, in place of an
+# instrument.StepRecorder
+class _Timer:
+    def __init__(self):
+        self.inference = 0.0
+        self.reward = 0.0
+
+    def record(self, cell, step, prompt, inference_s, invalid, reward_s):
+        self.inference += inference_s
+        self.reward += reward_s
+
+
+# Run episodes of one bandit type against FakeBackend through the code the
+# experiments run: MAB one episode at a time when batch_size is 1, run_batch
+# in lockstep groups of batch_size otherwise. Hints are padded with
+# hint_length extra words to vary the prompt length, and the trial history is
+# shown with the given mab.TrialContext policy. Parsing the answers is timed
+# by FakeBackend and taken out of inference; the rest of the step (prompt
+# building, bookkeeping) is prompt.
+def run_case(
+    config, bandit_type, hint_length, batch_size, episodes, n_iters, cache, seed, context="full"
+):
+    config = dict(config, n_iters=n_iters, batch_size=batch_size, context=context, quiet=True)
+    plan = Plan(config)
+    cells = []
+    for i in range(episodes):
+        cell = plan[i % len(plan)]
+        cells.append(cell._replace(hint=cell.hint + " word" * hint_length))
+
+    backend = FakeBackend(seed=seed, cache=cache)
+    timer = _Timer()
+
+    def make_bandit(cell):
+        bandit = getattr(bandits, bandit_type + "_MAB")()
+        bandit.set_narms(config["narms"])
+        bandit.set_stds(config["arm_stds"])
+        bandit.means = np.array(cell.arms)
+        return bandit
+
+    start = time.perf_counter()
+    for g in range(0, episodes, batch_size):
+        group = cells[g : g + batch_size]
+        seed_rngs(group[0].seed)
+        if batch_size == 1:
+            trials = make_context(config, config["narms"])
+            MAB(backend, group[0], make_bandit(group[0]), n_iters, timer, False, trials)
+        else:
+            run_batch(backend, [(c, make_bandit(c)) for c in group], config, timer)
+    seconds = time.perf_counter() - start
+    steps = episodes * n_iters
+
+    split = {
+        "prompt": seconds - timer.inference - timer.reward,
+        "inference": timer.inference - backend.parse_s,
+        "parse": backend.parse_s,
+        "reward": timer.reward,
+    }
+    return {
+        "bandit": bandit_type,
+        "hint_length": hint_length,
+        "batch_size": batch_size,
+        "n_iters": n_iters,
+        "cache": cache,
+        "context": context,
+        "episodes": episodes,
+        "steps": steps,
+        "seconds": seconds,
+        "steps_per_sec": steps / seconds,
+        "prompt_tokens_per_step": backend.prompt_tokens / steps,
+        "prefilled_tokens_per_step": backend.prefilled / steps,
+        # peak of the process, which runs this case only (see isolated_case)
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "time_split": {k: v / seconds for k, v in split.items()},
+    }
+
+
+# run_case in a fresh process, so that its peak RSS is that of the case alone
+def isolated_case(*args):
+    with ProcessPoolExecutor(1, mp_context=mp.get_context("spawn")) as pool:
+        return pool.submit(run_case, *args).result()
+
+
+# cases slower than baseline by more than threshold (a fraction)
+def regressions(results, baseline, threshold):
+    base = {
+        tuple(c.get(k, CASE_DEFAULTS.get(k)) for k in CASE_KEYS): c
+        for c in baseline["cases"]
+    }
+    slow = []
+    for case in results["cases"]:
+        old = base.get(tuple(case[k] for k in CASE_KEYS))
+        if old is not None and case["steps_per_sec"] < old["steps_per_sec"] * (1 - threshold):
+            slow.append((case, old))
+    return slow
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config-file", type=str, default="config/stationary.json")
+    parser.add_argument("--bandits", nargs="+", default=BANDITS)
+    parser.add_argument("--hint-lengths", nargs="+", type=int, default=[0, 250])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 16])
+    parser.add_argument("--episodes", type=int, default=64)
+    parser.add_argument("--n-iters", type=int, default=N_ITERS)
+    parser.add_argument(
+        "--contexts",
+        nargs="+",
+        default=["full"],
+        help="trial history policies to compare (full, window, summary, hybrid)",
+    )
+    parser.add_argument(
+        "--cache", action="store_true", help="count only uncached tokens as prefilled"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None)
+    parser.add_argument(
+        "--compare", type=str, default=None, help="baseline JSON from an earlier run"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="fail when steps/sec drops by more than this fraction of the baseline",
+    )
+    args = parser.parse_args()
+
+    with open(args.config_file, "r") as f:
+        config = json.load(f)
+
+    results = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cases": [],
+    }
+    for bandit_type in args.bandits:
+        for hint_length in args.hint_lengths:
+            for batch_size in args.batch_sizes:
+                for context in args.contexts:
+                    case = isolated_case(
+                        config,
+                        bandit_type,
+                        hint_length,
+                        batch_size,
+                        args.episodes,
+                        args.n_iters,
+                        args.cache,
+                        args.seed,
+                        context,
+                    )
+                    results["cases"].append(case)
+                    split = ", ".join(f"{k} {v:.0%}" for k, v in case["time_split"].items())
+                    print(
+                        f"{bandit_type:>12} hint+{hint_length:<4} batch {batch_size:<4} "
+                        f"{context:>7} {case['steps_per_sec']:>10.0f} steps/s "
+                        f"{case['prefilled_tokens_per_step']:>7.1f} tok/step  {split}"
+                    )
+
+    output = args.output or f"bench_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        slow = regressions(results, baseline, args.threshold)
+        for case, old in slow:
+            print(
+                f"REGRESSION {case['bandit']} hint+{case['hint_length']} "
+                f"batch {case['batch_size']}: {case['steps_per_sec']:.0f} steps/s, "
+                f"was {old['steps_per_sec']:.0f}"
+            )
+        if slow:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,3 +5,5 @@ QUESTION = "Which arm should you choose next? Your options are 1, 2, 3, 4, or 5.
 SEED = 31825
 
 N_ITERS = 20
+
+MAX_SEQ_LENGTH = 4096
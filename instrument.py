@@ -0,0 +1,116 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+STEP_SCHEMA = pa.schema(
+    [
+        # row of the results file this step belongs to
+        pa.field("cell_id", pa.int64()),
+        pa.field("step", pa.int32()),
+        pa.field("prompt_chars", pa.int32()),
+        # -1 when the backend has no tokenizer
+        pa.field("prompt_tokens", pa.int32()),
+        pa.field("inference_s", pa.float32()),
+        # the answer was not an arm in 1..narms
+        pa.field("parse_failed", pa.bool_()),
+        pa.field("reward_s", pa.float32()),
+    ]
+)
+
+
+# Opt-in per-step cost records of the episodes of a run, written to a sidecar
+# parquet file next to the results and summed up per hint for the summary.
+# count_tokens is the backend's tokenizer count, if it has one.
+class StepRecorder:
+    def __init__(self, path, count_tokens=None, row_group_size=65536):
+        self.path = path
+        self.count_tokens = count_tokens
+        self.row_group_size = row_group_size
+        self.writer = pq.ParquetWriter(path, STEP_SCHEMA)
+        self.columns = {f.name: [] for f in STEP_SCHEMA}
+        # hint -> [steps, prompt tokens, inference seconds, parse failures]
+        self.totals = {}
+
+    def record(self, cell, step, prompt, inference_s, parse_failed, reward_s):
+        chars = len(prompt) if prompt is not None else 0
+        tokens = -1
+        if prompt is not None and self.count_tokens is not None:
+            tokens = self.count_tokens(prompt)
+
+        c = self.columns
+        c["cell_id"].append(cell.cell_id)
+        c["step"].append(step)
+        c["prompt_chars"].append(chars)
+        c["prompt_tokens"].append(tokens)
+        c["inference_s"].append(inference_s)
+        c["parse_failed"].append(parse_failed)
+        c["reward_s"].append(reward_s)
+
+        totals = self.totals.setdefault(cell.og_hint, [0, 0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += max(tokens, 0)
+        totals[2] += inference_s
+        totals[3] += parse_failed
+
+        if len(c["step"]) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.columns["step"]:
+            return
+        table = pa.table(
+            {f.name: pa.array(self.columns[f.name], f.type) for f in STEP_SCHEMA},
+            schema=STEP_SCHEMA,
+        )
+        self.writer.write_table(table)
+        self.columns = {f.name: [] for f in STEP_SCHEMA}
+
+    def close(self):
+        if self.writer is not None:
+            self.flush()
+            self.writer.close()
+            self.writer = None
+
+    def summary(self):
+        return summarize(self.totals)
+
+
+# add the per-hint totals of another StepRecorder (a worker's) to totals
+def merge_totals(totals, other):
+    for hint, t in other.items():
+        mine = totals.setdefault(hint, [0, 0, 0.0, 0])
+        for i, v in enumerate(t):
+            mine[i] += v
+    return totals
+
+
+# totals of the run and the hints by share of inference time
+def summarize(hint_totals):
+    if not hint_totals:
+        return "No steps recorded"
+    totals = np.array([t for t in hint_totals.values()], dtype=float)
+    steps, tokens, seconds, failed = totals.sum(axis=0)
+    lines = [
+        f"{int(steps)} steps, {tokens / steps:.0f} prompt tokens/step, "
+        f"{seconds:.1f} s inference ({seconds / steps * 1000:.1f} ms/step), "
+        f"{int(failed)} parse failures ({failed / steps:.1%})"
+    ]
+    seconds = max(seconds, 1e-9)
+    order = np.argsort(-totals[:, 2])
+    hints = list(hint_totals)
+    for i in order:
+        n, tok, sec, bad = totals[i]
+        lines.append(
+            f"  {sec / seconds:6.1%} of inference  {tok / n:6.0f} tok/step  "
+            f"{int(bad):4d} failures  {hints[i]}"
+        )
+    return "\n".join(lines)
+
+
+# sidecar path of the step records that session (a timestamp) of a run adds
+# to a results file, a new one per session since --resume continues a run;
+# with worker, that worker's part of them
+def steps_path(output, session, worker=None):
+    part = "" if worker is None else f".worker{worker}"
+    return output[: -len(".parquet")] + f".steps.{session}{part}.parquet"
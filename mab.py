@@ -1,46 +1,163 @@
-import torch
+import time
 import random
-import pandas as pd
-from config.constants import MAIN_TEXT, QUESTION, SEED, N_ITERS
+from collections import deque
+from config.constants import MAIN_TEXT, QUESTION, N_ITERS
 
-torch.cuda.manual_seed_all(SEED)
+
+# parse the generated arm label, None if it is not a number
+def parse_choice(text):
+    try:
+        return int(text)
+    except ValueError:
+        return None
+
+
+# task text shown before the trials of an episode
+def make_instruction(hint):
+    return MAIN_TEXT + "\n\nYour hint for this round is: " + hint + "\n"
+
+
+# one line of trial history
+def trial_text(step, choice, reward):
+    return f"Trial {step}: You chose arm <<{choice}>> and received a reward of {reward:.2f}."
+
+
+CONTEXT_POLICIES = ["full", "window", "summary", "hybrid"]
+
+
+# Trial history shown to the model. "full" (default) lists every trial so far;
+# "window" only the last window trials; "summary" a table of pulls and mean
+# reward per arm; "hybrid" the table followed by the last window trials. All
+# but "full" keep the prompt the same length however many trials there are.
+# The table only counts the arms the model named: a random arm is pulled for
+# an invalid answer, but the model did not choose it, so those trials are
+# counted as invalid answers instead.
+class TrialContext:
+    def __init__(self, narms, policy="full", window=10):
+        if policy not in CONTEXT_POLICIES:
+            raise ValueError(f"unknown context policy {policy}")
+        self.narms = narms
+        self.policy = policy
+        self.window = window
+        self.history = ""
+        self.recent = deque(maxlen=window)
+        self.counts = [0] * narms
+        self.sums = [0.0] * narms
+        self.invalid = 0
+        self.trials = 0
+
+    # how the policy is recorded in the results
+    @property
+    def name(self):
+        if self.policy in ("window", "hybrid"):
+            return f"{self.policy}:{self.window}"
+        return self.policy
+
+    # choice is the model's answer, arm the 0-based arm that was pulled
+    def add(self, step, choice, arm, reward):
+        line = trial_text(step, choice, reward) + "\n"
+        if self.policy == "full":
+            self.history += line
+        else:
+            self.recent.append(line)
+        if choice is not None and 1 <= choice <= self.narms:
+            self.counts[arm] += 1
+            self.sums[arm] += reward
+        else:
+            self.invalid += 1
+        self.trials += 1
+
+    def summary(self):
+        lines = [f"Summary of your {self.trials} trials so far:"]
+        for a in range(self.narms):
+            n = self.counts[a]
+            if n:
+                mean = self.sums[a] / n
+                lines.append(f"Arm {a + 1}: chosen {n} times, mean reward {mean:.2f}.")
+            else:
+                lines.append(f"Arm {a + 1}: not chosen yet.")
+        if self.invalid:
+            lines.append(f"{self.invalid} answers were not an arm number.")
+        return "\n".join(lines) + "\n"
+
+    def text(self):
+        if self.policy == "full":
+            return self.history
+        recent = "".join(self.recent)
+        if self.policy == "summary":
+            return self.summary() if self.trials else ""
+        if self.policy == "hybrid":
+            return (self.summary() if self.trials else "") + recent
+        if self.trials > len(self.recent):
+            return "(earlier trials omitted)\n" + recent
+        return recent
+
+
+# context of config["context"]: a policy name, or {"policy": ..., "window": ...}
+def make_context(config, narms):
+    options = config.get("context", "full")
+    if isinstance(options, str):
+        options = {"policy": options}
+    return TrialContext(narms, **options)
 
 
 # Run one MAB experiment
-def MAB(pipe, hint, bandit):
-    instruction = MAIN_TEXT + "\n\nYour hint for this round is: " + hint + "\n"
-    print(instruction)
+# cell is the planner.Plan cell being played, backend one of backends.py;
+# recorder, an instrument.StepRecorder, gets the cost of every step and
+# verbose=False turns off the per-trial printing; context, a TrialContext,
+# decides how the trials so far are shown (all of them by default)
+def MAB(backend, cell, bandit, n_iters=N_ITERS, recorder=None, verbose=True, context=None):
+    instruction = make_instruction(cell.hint)
+    if verbose:
+        print(instruction)
 
     arm_counts = [0] * bandit.narms
     arm_rewards = [0] * bandit.narms
     total_rewards = 0
     hist = []
-    history_instruction = ""
+    probs = []
+    if context is None:
+        context = TrialContext(bandit.narms)
+    bandit.reset()
+    backend.reset([cell])
 
-    for step in range(N_ITERS):
-        input_text = instruction + history_instruction + QUESTION
-        choice = int(pipe(input_text)[0]["generated_text"][len(input_text) :])
+    for step in range(n_iters):
+        input_text = None
+        if backend.needs_prompts:
+            input_text = instruction + context.text() + QUESTION
+        t0 = time.perf_counter()
+        choices, p = backend.choose([input_text])
+        t1 = time.perf_counter()
+        choice = choices[0]
+        if p is not None:
+            probs.append(p[0].tolist())
 
-        if 1 <= choice <= bandit.narms:
-            hist.append(choice)
-            chosen_idx = choice - 1
+        valid = choice is not None and 1 <= choice <= bandit.narms
+        if valid:
+            hist.append(int(choice))
+            chosen_idx = int(choice) - 1
 
         else:
             hist.append(None)
             chosen_idx = random.randint(0, bandit.narms - 1)
 
+        t2 = time.perf_counter()
         reward = bandit.get_reward(chosen_idx)
+        t3 = time.perf_counter()
+        if recorder is not None:
+            recorder.record(cell, step, input_text, t1 - t0, not valid, t3 - t2)
+        backend.observe([chosen_idx], [reward])
         arm_counts[chosen_idx] += 1
         arm_rewards[chosen_idx] += reward
         total_rewards += reward
 
-        history_instruction += f"Trial {step}: You chose arm <<{choice}>> and received a reward of {reward:.2f}.\n"
+        context.add(step, choice, chosen_idx, reward)
 
-        print(
-            f"Trial {step}: You chose arm <<{choice}>> and received a reward of {reward:.2f}."
-        )
+        if verbose:
+            print(trial_text(step, choice, reward))
 
-    print(f"Total Arm Counts :" + str(arm_counts))
-    print(f"Actual Arm Means: {bandit.means}")
+    if verbose:
+        print(f"Total Arm Counts :" + str(arm_counts))
+        print(f"Actual Arm Means: {bandit.means}")
 
-    return hist
+    return hist, probs
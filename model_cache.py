@@ -0,0 +1,94 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+from contextlib import contextmanager
+
+
+# where quantized models are kept unless config["model_cache"] says otherwise
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "su_ibt", "models")
+ARTIFACT_FILE = "artifact.json"
+
+
+# directory of the cached copy of a model, one per model, quantization and
+# sequence length since those are baked into the saved weights
+def artifact_dir(config, max_seq_length):
+    root = config.get("model_cache", CACHE_DIR)
+    name = config["model_name"].replace("/", "--")
+    return os.path.join(root, f"{name}-4bit-{max_seq_length}")
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 24), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# Whether path holds a complete artifact of model_name: every file listed in
+# artifact.json is there with its recorded size, and with full its recorded
+# hash (which reads every byte, so only on request).
+def verify_artifact(path, model_name, full=False):
+    try:
+        with open(os.path.join(path, ARTIFACT_FILE), "r") as f:
+            artifact = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if artifact.get("model_name") != model_name:
+        return False
+    for name, entry in artifact["files"].items():
+        file = os.path.join(path, name)
+        if not os.path.isfile(file) or os.path.getsize(file) != entry["size"]:
+            return False
+        if full and _sha256(file) != entry["sha256"]:
+            return False
+    return True
+
+
+# Hold an exclusive lock on the artifact at path, so that of several processes
+# finding the cache cold (--workers K) one fills it and the others wait for it
+# and then load the saved copy.
+@contextmanager
+def artifact_lock(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# Save a loaded model and tokenizer to path as safetensors, which later loads
+# memory-map, with artifact.json listing every file. Written to a temporary
+# directory of this process first so an interrupted save never looks complete.
+# A LoRA adapter (model_name of a PeftModel) is merged into its 4-bit base
+# first: save_pretrained would write the adapter weights alone, which cannot be
+# loaded without downloading the base again.
+def save_artifact(model, tokenizer, path, model_name):
+    tmp = f"{path}.tmp{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    if hasattr(model, "peft_config"):
+        model.save_pretrained_merged(tmp, tokenizer, save_method="merged_4bit_forced")
+    else:
+        model.save_pretrained(tmp, safe_serialization=True)
+        tokenizer.save_pretrained(tmp)
+    if os.path.exists(os.path.join(tmp, "adapter_config.json")):
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise RuntimeError(f"saving {model_name} wrote only its adapter")
+
+    files = {}
+    for root, _, names in os.walk(tmp):
+        for name in names:
+            file = os.path.join(root, name)
+            files[os.path.relpath(file, tmp)] = {
+                "size": os.path.getsize(file),
+                "sha256": _sha256(file),
+            }
+    with open(os.path.join(tmp, ARTIFACT_FILE), "w") as f:
+        json.dump({"model_name": model_name, "files": files}, f, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
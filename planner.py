@@ -0,0 +1,161 @@
+from collections import namedtuple
+import numpy as np
+from config.constants import SEED, MAIN_TEXT
+from rotator import BanditArmsRotator, HintTemplate
+from streams import hash_ints
+
+
+CELL_DTYPE = np.dtype(
+    [
+        ("cell_id", np.int64),
+        ("arms_idx", np.int16),
+        ("rotation", np.int16),
+        ("hint_idx", np.int16),
+        ("rep", np.int32),
+        ("seed", np.uint32),
+    ]
+)
+
+class Cell(
+    namedtuple(
+        "Cell",
+        "cell_id arms_idx rotation hint_idx rep seed og_arms arms og_hint hint",
+    )
+):
+    # (arm set, rotation, hint, rep) indices
+    @property
+    def key(self):
+        return (self.arms_idx, self.rotation, self.hint_idx, self.rep)
+
+
+# uint32 seeds of cells, the same wherever and in whatever order they run,
+# hashed from their indices for whole columns at once
+def cell_seeds(arms_idx, rotation, hint_idx, rep):
+    h = hash_ints(np.full(np.shape(rep), SEED), arms_idx, rotation, hint_idx, rep)
+    return (h >> np.uint64(32)).astype(np.uint32)
+
+
+# seed of one cell
+def cell_seed(arms_idx, rotation, hint_idx, rep):
+    return int(cell_seeds(arms_idx, rotation, hint_idx, rep))
+
+
+# The experiment grid (arm set x rotation x hint x rep) as a table with one row
+# per episode. cell_id is the position in the original nested loop order, which
+# is also the order results are written in. Runners iterate over the plan, which
+# can be reordered, grouped, batched or sharded without changing any cell.
+class Plan:
+    def __init__(self, config, cells=None):
+        self.config = config
+        self.narms = config["narms"]
+        self.arm_sets = config["arm_means"]
+        self.hints = config["hints"]
+        self.templates = [HintTemplate(h, self.narms) for h in self.hints]
+
+        # arm values of every rotation, in the order BanditArmsRotator gives them
+        self.rotations = []
+        for a in self.arm_sets:
+            rotator = BanditArmsRotator(a, [])
+            self.rotations.append([rotator.next()[0] for _ in range(self.narms)])
+
+        self._hint_text = {}
+
+        if cells is None:
+            shape = (len(self.arm_sets), self.narms, len(self.hints), config["ntrials"])
+            grid = np.indices(shape).reshape(len(shape), -1)
+            cells = np.zeros(grid.shape[1], dtype=CELL_DTYPE)
+            cells["cell_id"] = np.arange(grid.shape[1])
+            cells["arms_idx"], cells["rotation"] = grid[0], grid[1]
+            cells["hint_idx"], cells["rep"] = grid[2], grid[3]
+            cells["seed"] = cell_seeds(*grid)
+        self.cells = cells
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __getitem__(self, i):
+        c = self.cells[i]
+        a, r, h = int(c["arms_idx"]), int(c["rotation"]), int(c["hint_idx"])
+        return Cell(
+            int(c["cell_id"]),
+            a,
+            r,
+            h,
+            int(c["rep"]),
+            int(c["seed"]),
+            self.arm_sets[a],
+            self.rotations[a][r],
+            self.hints[h],
+            self.hint_text(a, r, h),
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def hint_text(self, arms_idx, rotation, hint_idx):
+        key = (arms_idx, rotation, hint_idx)
+        if key not in self._hint_text:
+            arms = self.rotations[arms_idx][rotation]
+            self._hint_text[key] = self.templates[hint_idx].render(arms)
+        return self._hint_text[key]
+
+    # cell_id of a (arm set, rotation, hint, rep) key
+    def cell_id(self, key):
+        a, r, h, rep = key
+        return ((a * self.narms + r) * len(self.hints) + h) * self.config["ntrials"] + rep
+
+    def subset(self, index):
+        return Plan(self.config, self.cells[index])
+
+    # cells with the same hint text next to each other, so the prompt prefix
+    # they share stays in the cache
+    def grouped_by_hint(self):
+        texts = [
+            self.hint_text(int(c["arms_idx"]), int(c["rotation"]), int(c["hint_idx"]))
+            for c in self.cells
+        ]
+        order = sorted(range(len(self)), key=lambda i: (texts[i], self.cells[i]["cell_id"]))
+        return self.subset(np.array(order, dtype=np.int64))
+
+    # rough prefill cost of a cell: its instruction length in characters, which is
+    # repeated in every one of the n_iters prompts of the episode
+    def prompt_lengths(self):
+        return np.array(
+            [
+                len(self.hint_text(int(c["arms_idx"]), int(c["rotation"]), int(c["hint_idx"])))
+                for c in self.cells
+            ]
+        )
+
+    # cells of shard index out of num, balanced by prompt length: cells are
+    # dealt longest first to the least loaded shard, ties going to the lowest
+    # cell_id and shard index, so every node computes the same assignment
+    def shard(self, index, num):
+        if not 0 <= index < num:
+            raise ValueError(f"shard index {index} out of range for {num} shards")
+        cost = self.prompt_lengths() + len(MAIN_TEXT)
+        order = np.lexsort((self.cells["cell_id"], -cost))
+        load = np.zeros(num)
+        owner = np.empty(len(self), dtype=np.int64)
+        for i in order:
+            s = int(np.argmin(load))
+            owner[i] = s
+            load[s] += cost[i]
+        return self.subset(np.flatnonzero(owner == index))
+
+    def batches(self, size):
+        for start in range(0, len(self), size):
+            yield self.subset(slice(start, start + size))
+
+
+# plan of a config, in the order given by its cell_order key: "grid" (default)
+# runs cells in the nested loop order, "hint" groups cells by hint text
+def make_plan(config):
+    plan = Plan(config)
+    order = config.get("cell_order", "grid")
+    if order == "hint":
+        plan = plan.grouped_by_hint()
+    elif order != "grid":
+        raise ValueError(f"unknown cell_order {order}")
+    return plan
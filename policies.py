@@ -0,0 +1,181 @@
+import numpy as np
+from rotator import HintTemplate
+from streams import EpisodeStreams
+
+
+# Classical bandit agents, vectorized over E episodes. They follow the backend
+# protocol of backends.py without prompts: reset(episodes) with the cells being
+# played, choose(None) -> (1-based arms, probabilities or None), and
+# observe(arm indices, rewards).
+class Agent:
+    needs_prompts = False
+
+    def __init__(self, seed=None, initial=50.0):
+        self.rng = np.random.default_rng(seed)
+        self.initial = initial
+
+    def seed(self, seed):
+        self.rng = np.random.default_rng(seed)
+
+    # one stream per episode, seeded by its cell (see streams.EpisodeStreams)
+    def seed_episodes(self, seeds):
+        self.rng = EpisodeStreams(seeds, stream=1)
+
+    def reset(self, episodes):
+        self.nenvs = len(episodes)
+        self.narms = len(episodes[0].arms)
+        self.counts = np.zeros((self.nenvs, self.narms))
+        self.sums = np.zeros((self.nenvs, self.narms))
+        self.t = 0
+        self._envs = np.arange(self.nenvs)
+
+    # mean reward of each arm so far, initial for arms not tried yet
+    def estimates(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.counts > 0, self.sums / self.counts, self.initial)
+
+    # arm index per episode, first untried arm where there is one
+    def _untried_first(self, values):
+        untried = self.counts == 0
+        values = np.where(untried, np.inf, values)
+        return np.argmax(values, axis=1)
+
+    # one draw per row from the categorical distributions in probs
+    def _sample(self, probs):
+        u = self.rng.random((self.nenvs, 1))
+        idx = (u > np.cumsum(probs, axis=1)).sum(axis=1)
+        return np.minimum(idx, self.narms - 1)
+
+    def choose(self, prompts=None):
+        raise NotImplementedError
+
+    def observe(self, arms, rewards):
+        self.counts[self._envs, arms] += 1
+        self.sums[self._envs, arms] += rewards
+        self.t += 1
+
+
+# upper confidence bound, with rewards scaled to about [0, 1] by scale
+class UCB1(Agent):
+    def __init__(self, seed=None, scale=100.0, c=1.0):
+        super().__init__(seed)
+        self.scale = scale
+        self.c = c
+
+    def choose(self, prompts=None):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            bonus = self.c * np.sqrt(2 * np.log(max(self.t, 1)) / self.counts)
+        values = self.estimates() / self.scale + bonus
+        return self._untried_first(values) + 1, None
+
+
+class EpsilonGreedy(Agent):
+    def __init__(self, seed=None, epsilon=0.1, initial=50.0):
+        super().__init__(seed, initial)
+        self.epsilon = epsilon
+
+    def choose(self, prompts=None):
+        greedy = np.argmax(self.estimates(), axis=1)
+        probs = np.full((self.nenvs, self.narms), self.epsilon / self.narms)
+        probs[self._envs, greedy] += 1 - self.epsilon
+        return self._sample(probs) + 1, probs
+
+
+class Softmax(Agent):
+    def __init__(self, seed=None, temperature=5.0, initial=50.0):
+        super().__init__(seed, initial)
+        self.temperature = temperature
+
+    def choose(self, prompts=None):
+        logits = self.estimates() / self.temperature
+        probs = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probs /= probs.sum(axis=1, keepdims=True)
+        return self._sample(probs) + 1, probs
+
+
+# Thompson sampling with a Gaussian prior on each arm mean and known noise std
+class Thompson(Agent):
+    def __init__(self, seed=None, prior_mean=50.0, prior_std=30.0, noise_std=10.0):
+        super().__init__(seed)
+        self.prior_mean = prior_mean
+        self.prior_std = prior_std
+        self.noise_std = noise_std
+
+    def reset(self, episodes):
+        super().reset(episodes)
+        shape = (self.nenvs, self.narms)
+        self.mu0 = np.full(shape, float(self.prior_mean))
+        self.tau0 = np.full(shape, float(self.prior_std))
+
+    def choose(self, prompts=None):
+        precision = 1 / self.tau0**2 + self.counts / self.noise_std**2
+        mean = (self.mu0 / self.tau0**2 + self.sums / self.noise_std**2) / precision
+        draw = mean + self.rng.standard_normal(mean.shape) / np.sqrt(precision)
+        return np.argmax(draw, axis=1) + 1, None
+
+
+# Thompson sampling whose prior follows the hint: every arm a hint refers to by
+# rank ({max2}, {min2}, ...) gets a prior mean at that rank between low and
+# high, with a tighter std. Hints without rank placeholders leave the prior flat.
+class HintThompson(Thompson):
+    def __init__(
+        self,
+        seed=None,
+        prior_mean=50.0,
+        prior_std=30.0,
+        noise_std=10.0,
+        low=10.0,
+        high=90.0,
+        hint_std=15.0,
+    ):
+        super().__init__(seed, prior_mean, prior_std, noise_std)
+        self.low = low
+        self.high = high
+        self.hint_std = hint_std
+        self._templates = {}
+
+    def reset(self, episodes):
+        super().reset(episodes)
+        for e, cell in enumerate(episodes):
+            if cell.og_hint not in self._templates:
+                self._templates[cell.og_hint] = HintTemplate(cell.og_hint, self.narms)
+            template = self._templates[cell.og_hint]
+            for arm, rank in template.mentioned_arms(cell.arms):
+                frac = rank / max(self.narms - 1, 1)
+                self.mu0[e, arm] = self.low + (self.high - self.low) * frac
+                self.tau0[e, arm] = self.hint_std
+
+
+AGENTS = {
+    "ucb1": UCB1,
+    "epsilon_greedy": EpsilonGreedy,
+    "softmax": Softmax,
+    "thompson": Thompson,
+    "hint_thompson": HintThompson,
+}
+
+
+# agent named by config["backend"], with keyword arguments from config["agent"]
+def make_agent(config):
+    name = config["backend"]
+    if name not in AGENTS:
+        raise ValueError(f"unknown backend {name}, expected llm or one of {list(AGENTS)}")
+    # the probs column holds the label probabilities of a language model
+    if config.get("scoring", False):
+        raise ValueError(f"scoring is only available with the llm backend, not {name}")
+    return AGENTS[name](**config.get("agent", {}))
+
+
+# Play E episodes of n_iters steps against a batched bandit (bandits.*_BatchMAB)
+# whose means are the arms of the episodes. Returns the (E, n_iters) int8
+# matrix of 1-based choices.
+def simulate(agent, bandit, episodes, n_iters):
+    agent.reset(episodes)
+    bandit.reset()
+    hist = np.empty((len(episodes), n_iters), dtype=np.int8)
+    for t in range(n_iters):
+        choices, _ = agent.choose(None)
+        arms = choices - 1
+        agent.observe(arms, bandit.step(arms))
+        hist[:, t] = choices
+    return hist
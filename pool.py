@@ -0,0 +1,148 @@
+import os
+import queue
+import traceback
+import multiprocessing as mp
+from contextlib import contextmanager
+
+
+# Sends a worker's finished rows back to the process that writes them
+class _QueueSink:
+    def __init__(self, out):
+        self.out = out
+        self.rows = 0
+
+    def add(self, row):
+        self.out.put(("row", row))
+        self.rows += 1
+
+
+# CUDA_VISIBLE_DEVICES set to device while starting a process. A spawned
+# process gets the environment as it is at start(), before it re-imports the
+# main module and with it torch, so this is the only reliable place to pick it.
+@contextmanager
+def _visible_device(device):
+    if device is None:
+        yield
+        return
+    old = os.environ.get("CUDA_VISIBLE_DEVICES")
+    os.environ["CUDA_VISIBLE_DEVICES"] = str(device)
+    try:
+        yield
+    finally:
+        if old is None:
+            del os.environ["CUDA_VISIBLE_DEVICES"]
+        else:
+            os.environ["CUDA_VISIBLE_DEVICES"] = old
+
+
+# Worker process: loads its own backend, with its own model on the device it
+# was started with (see run_pool), and runs chunks of cells from the task
+# queue until it gets None
+def _worker(index, config, tasks, out):
+    try:
+        from run import load_model, run_experiment
+        from backends import make_backend, uses_model
+        from planner import Plan
+
+        pipe = load_model(config)[2] if uses_model(config) else None
+        backend = make_backend(config, pipe)
+
+        # with --instrument every worker writes its own step records
+        recorder = None
+        if config.get("instrument", False):
+            from instrument import StepRecorder, steps_path
+
+            path = steps_path(config["output"], config["steps_session"], index)
+            recorder = StepRecorder(path, getattr(backend, "count_tokens", None))
+
+        sink = _QueueSink(out)
+        try:
+            while True:
+                cells = tasks.get()
+                if cells is None:
+                    break
+                run_experiment(backend, config, sink, plan=Plan(config, cells), recorder=recorder)
+        finally:
+            if recorder is not None:
+                recorder.close()
+        if recorder is not None:
+            out.put(("steps", recorder.totals))
+        out.put(("done", index))
+    except BaseException:
+        out.put(("error", traceback.format_exc()))
+
+
+# Run the cells of plan on nworkers processes. Rows come back through a queue
+# and are written here only, in cell_id order, and recorded to progress. Every
+# cell is seeded from its own indices, so the output does not depend on the
+# number of workers. On failure or interrupt the workers are stopped; rows that
+# were already recorded can be picked up with --resume. Returns the per-hint
+# step totals of the workers with --instrument (see instrument.summarize).
+def run_pool(config, results, progress, plan, nworkers):
+    from results import OrderedResults
+    from policies import AGENTS
+    from instrument import merge_totals
+
+    results = OrderedResults(results, plan.cells["cell_id"].tolist())
+    keys = {}
+    todo = []
+    for i, cell in enumerate(plan):
+        keys[cell.cell_id] = cell.key
+        if progress is None or cell.key not in progress:
+            todo.append(i)
+    if progress is not None:
+        for key, row in progress.entries():
+            results.add(plan.cell_id(key), row)
+
+    ctx = mp.get_context("spawn")
+    tasks = ctx.Queue()
+    out = ctx.Queue()
+
+    chunk = config.get("batch_size", 1) * config.get("overlap", 1)
+    if config.get("backend", "llm") in AGENTS:
+        chunk = config.get("policy_batch", 65536)
+    for start in range(0, len(todo), chunk):
+        tasks.put(plan.cells[todo[start : start + chunk]])
+    for _ in range(nworkers):
+        tasks.put(None)
+
+    workers = [
+        ctx.Process(target=_worker, args=(i, config, tasks, out), daemon=True)
+        for i in range(nworkers)
+    ]
+    devices = config.get("devices")
+    for i, w in enumerate(workers):
+        with _visible_device(devices[i % len(devices)] if devices else None):
+            w.start()
+
+    step_totals = {}
+    try:
+        remaining = len(todo)
+        running = nworkers
+        while remaining > 0 or running > 0:
+            try:
+                kind, payload = out.get(timeout=5)
+            except queue.Empty:
+                dead = [w for w in workers if w.exitcode not in (None, 0)]
+                if dead:
+                    raise RuntimeError(f"worker exited with code {dead[0].exitcode}")
+                continue
+
+            if kind == "row":
+                results.add(payload["cell_id"], payload)
+                if progress is not None:
+                    progress.record(keys[payload["cell_id"]], payload)
+                remaining -= 1
+            elif kind == "steps":
+                merge_totals(step_totals, payload)
+            elif kind == "done":
+                running -= 1
+            else:
+                raise RuntimeError("worker failed:\n" + payload)
+    finally:
+        for w in workers:
+            if w.is_alive():
+                w.terminate()
+        for w in workers:
+            w.join()
+    return step_totals
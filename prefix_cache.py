@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from transformers import DynamicCache
+
+
+# KV states of shared prompt prefixes (MAIN_TEXT, MAIN_TEXT + hint), keyed on
+# their token ids. Entries are forked into a fresh cache for each episode and
+# evicted least recently used first once the memory budget is exceeded.
+class PrefixCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, ids):
+        return tuple(ids) in self.entries
+
+    # length of the longest stored prefix of ids, 0 when none is stored
+    def lookup(self, ids):
+        ids = tuple(ids)
+        best = 0
+        for key in self.entries:
+            if best < len(key) <= len(ids) and ids[: len(key)] == key:
+                best = len(key)
+        return best
+
+    # fresh cache holding a copy of the stored prefix ids, only taken when the
+    # caller will use it, so a lookup that loses to the live cache costs nothing
+    def fork(self, ids):
+        ids = tuple(ids)
+        self.hits += 1
+        self.entries.move_to_end(ids)
+        layers, _ = self.entries[ids]
+        return DynamicCache.from_legacy_cache(
+            tuple((k.clone(), v.clone()) for k, v in layers)
+        )
+
+    # store the first len(ids) positions of cache under ids
+    def insert(self, ids, cache):
+        ids = tuple(ids)
+        if ids in self.entries:
+            self.entries.move_to_end(ids)
+            return
+
+        n = len(ids)
+        layers = tuple(
+            (k[..., :n, :].clone(), v[..., :n, :].clone())
+            for k, v in cache.to_legacy_cache()
+        )
+        size = sum(k.nbytes + v.nbytes for k, v in layers)
+        if size > self.max_bytes:
+            return
+
+        self.entries[ids] = (layers, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.nbytes -= evicted
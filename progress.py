@@ -0,0 +1,167 @@
+import os
+import re
+import json
+import time
+import glob
+import base64
+import sys
+import random
+import numpy as np
+
+
+# Durable log of finished episodes, one JSON line per (arm set, rotation, hint,
+# rep) cell with its result row and, where the run restores it on resume, the
+# RNG state after it. Kept next to the output file so an interrupted sweep can
+# be resumed losing at most the episode (or batch) in flight. Every line is
+# handed to the OS at once, but synced to disk only every sync_rows lines or
+# sync_seconds, so a machine crash can lose the last second of episodes.
+class ProgressLog:
+    def __init__(self, path, resume=False, sync_rows=256, sync_seconds=1.0):
+        self.path = path
+        self.done = {}
+        self.rng = None
+        self.sync_rows = sync_rows
+        self.sync_seconds = sync_seconds
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+        if resume and os.path.exists(path):
+            with open(path, "r+") as f:
+                text = f.read()
+                # a line cut off by the interruption is dropped
+                complete = text[: text.rfind("\n") + 1]
+                f.seek(0)
+                f.truncate(len(complete.encode()))
+            for line in complete.splitlines():
+                entry = json.loads(line)
+                self.done[tuple(entry["cell"])] = entry["row"]
+                self.rng = entry.get("rng", self.rng)
+
+        self.file = open(path, "a" if resume else "w")
+
+    def __contains__(self, cell):
+        return tuple(cell) in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    # (cell, row) of the finished cells, in the order they were run
+    def entries(self):
+        return list(self.done.items())
+
+    # with rng, also the RNG state, for runs that call restore_rng on resume
+    def record(self, cell, row, rng=False):
+        entry = {"cell": list(cell), "row": row}
+        if rng:
+            entry["rng"] = get_rng_state()
+        self.file.write(json.dumps(entry, default=_to_json) + "\n")
+        self.file.flush()
+        self.done[tuple(cell)] = row
+        self.unsynced += 1
+        if (
+            self.unsynced >= self.sync_rows
+            or time.monotonic() - self.synced_at >= self.sync_seconds
+        ):
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    # continue the random streams where the last finished episode left them
+    def restore_rng(self):
+        if self.rng is not None:
+            set_rng_state(self.rng)
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+def progress_path(output):
+    return output + ".progress.jsonl"
+
+
+# most recently modified progress log of a bandit type and shard (the
+# "_shard<i>-of-<n>" part of the output name, "" for an unsharded run), for
+# --resume without --output
+def latest_progress(bandit, shard="", directory="."):
+    name = re.compile(re.escape(bandit + shard) + r"_\d{8}-\d{6}\.parquet\.progress\.jsonl")
+    logs = [
+        path
+        for path in glob.glob(os.path.join(directory, f"{bandit}{shard}_*.progress.jsonl"))
+        if name.fullmatch(os.path.basename(path))
+    ]
+    if not logs:
+        return None
+    return max(logs, key=os.path.getmtime)
+
+
+# torch if a model backend has loaded it; runs without a model (classical
+# agents, --merge, a remote server) never import it
+def _torch():
+    return sys.modules.get("torch")
+
+
+# seed every random stream from one cell seed
+def seed_rngs(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch = _torch()
+    if torch is not None:
+        torch.manual_seed(seed)
+
+
+def get_rng_state():
+    np_state = np.random.get_state()
+    state = {
+        "numpy": [np_state[0], np_state[1].tolist(), *np_state[2:]],
+        "random": _to_lists(random.getstate()),
+    }
+    torch = _torch()
+    if torch is not None:
+        state["torch"] = _encode(torch.get_rng_state())
+        if torch.cuda.is_available():
+            state["cuda"] = [_encode(s) for s in torch.cuda.get_rng_state_all()]
+    return state
+
+
+def set_rng_state(state):
+    name, keys, pos, has_gauss, cached = state["numpy"]
+    np.random.set_state((name, np.array(keys, dtype=np.uint32), pos, has_gauss, cached))
+    version, internal, gauss_next = state["random"]
+    random.setstate((version, tuple(internal), gauss_next))
+    torch = _torch()
+    if torch is not None and "torch" in state:
+        torch.set_rng_state(_decode(state["torch"]))
+        if "cuda" in state and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all([_decode(s) for s in state["cuda"]])
+
+
+def _encode(tensor):
+    return base64.b64encode(tensor.numpy().tobytes()).decode("ascii")
+
+
+def _decode(text):
+    torch = _torch()
+    return torch.frombuffer(bytearray(base64.b64decode(text)), dtype=torch.uint8)
+
+
+def _to_lists(x):
+    if isinstance(x, tuple):
+        return [_to_lists(v) for v in x]
+    return x
+
+
+def _to_json(x):
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    if isinstance(x, np.generic):
+        return x.item()
+    raise TypeError(f"{type(x).__name__} is not JSON serializable")
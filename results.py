@@ -0,0 +1,228 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config.constants import N_ITERS
+
+
+# version 1 is the original layout (generic lists, plain strings, no
+# condition columns), 2 adds the condition index columns to the typed layout,
+# 3 the context policy column, 4 the optimal column, with arms again the means
+# at the end of the episode as in version 1
+SCHEMA_VERSION = 4
+VERSION_KEY = b"results_schema_version"
+
+STRING_COLUMNS = ["bandit", "og_hints", "hint", "context"]
+# indices of the cell in the experiment grid, see planner.Cell.key
+CONDITION_COLUMNS = ["arms_idx", "rotation", "hint_idx", "rep"]
+
+
+def results_schema(narms, n_iters, arms_type=pa.int64(), probs=False):
+    dict_string = pa.dictionary(pa.int32(), pa.string())
+    fields = [
+        # position of the cell in the experiment grid, see planner.Plan
+        pa.field("cell_id", pa.int64()),
+        *[pa.field(c, pa.int32()) for c in CONDITION_COLUMNS],
+        pa.field("bandit", dict_string),
+        pa.field("og_arms", pa.list_(arms_type, narms)),
+        pa.field("og_hints", dict_string),
+        # arm means at the end of the episode (drifted, or after the change step)
+        pa.field("arms", pa.list_(arms_type, narms)),
+        pa.field("hint", dict_string),
+        # trial history policy, see mab.TrialContext
+        pa.field("context", dict_string),
+        # chosen arm per trial, -1 where the model gave an invalid answer
+        pa.field("history", pa.list_(pa.int8(), n_iters)),
+        # 1-based best arm per trial by the means of that trial, -1 for rows
+        # replayed from progress logs written before this column
+        pa.field("optimal", pa.list_(pa.int8(), n_iters)),
+    ]
+    if probs:
+        fields.append(
+            pa.field("probs", pa.list_(pa.list_(pa.float32(), narms), n_iters))
+        )
+    return pa.schema(fields, metadata={VERSION_KEY: str(SCHEMA_VERSION).encode()})
+
+
+# schema version of a results file, read from its footer; files written before
+# the version was recorded are version 1
+def schema_version(path):
+    metadata = pq.read_schema(path).metadata or {}
+    return int(metadata.get(VERSION_KEY, b"1"))
+
+
+# Buffers result rows in fixed-size typed columns and writes them to one
+# parquet file a row group at a time, so memory stays flat over long sweeps
+# and everything up to the last flush survives a failure once closed.
+class ResultsWriter:
+    def __init__(
+        self, path, narms, n_iters, arms_type=pa.int64(), probs=False, row_group_size=128
+    ):
+        self.path = path
+        self.narms = narms
+        self.n_iters = n_iters
+        self.probs = probs
+        self.row_group_size = row_group_size
+        self.schema = results_schema(narms, n_iters, arms_type, probs)
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.rows = 0
+
+        arms_dtype = arms_type.to_pandas_dtype()
+        self._n = 0
+        self._cell_id = np.zeros(row_group_size, dtype=np.int64)
+        self._conditions = {c: np.zeros(row_group_size, dtype=np.int32) for c in CONDITION_COLUMNS}
+        self._og_arms = np.zeros((row_group_size, narms), dtype=arms_dtype)
+        self._arms = np.zeros((row_group_size, narms), dtype=arms_dtype)
+        self._history = np.full((row_group_size, n_iters), -1, dtype=np.int8)
+        self._optimal = np.full((row_group_size, n_iters), -1, dtype=np.int8)
+        if probs:
+            self._probs = np.zeros((row_group_size, n_iters, narms), dtype=np.float32)
+        self._codes = {c: np.zeros(row_group_size, dtype=np.int32) for c in STRING_COLUMNS}
+        self._values = {c: {} for c in STRING_COLUMNS}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # row has the keys of results_schema, with history as a list of choices
+    # (None for invalid) and probs as a T x narms nested list
+    def add(self, row):
+        i = self._n
+        for c in STRING_COLUMNS:
+            values = self._values[c]
+            # rows replayed from progress logs written before the context column
+            value = row.get(c, "full") if c == "context" else row[c]
+            self._codes[c][i] = values.setdefault(value, len(values))
+        self._cell_id[i] = row["cell_id"]
+        for c in CONDITION_COLUMNS:
+            # rows replayed from progress logs written before these columns
+            self._conditions[c][i] = row.get(c, -1)
+        self._og_arms[i] = row["og_arms"]
+        self._arms[i] = row["arms"]
+        history = row["history"]
+        if not isinstance(history, np.ndarray):
+            history = [-1 if c is None else c for c in history]
+        self._history[i] = history
+        if row.get("optimal") is not None:
+            self._optimal[i] = row["optimal"]
+        if self.probs:
+            self._probs[i] = row["probs"]
+
+        self._n += 1
+        self.rows += 1
+        if self._n == self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        n = self._n
+        if n == 0:
+            return
+
+        columns = {}
+        for c in STRING_COLUMNS:
+            columns[c] = pa.DictionaryArray.from_arrays(
+                pa.array(self._codes[c][:n]), pa.array(list(self._values[c]), pa.string())
+            )
+        columns["cell_id"] = pa.array(self._cell_id[:n])
+        for c in CONDITION_COLUMNS:
+            columns[c] = pa.array(self._conditions[c][:n])
+        columns["og_arms"] = _fixed_list(self._og_arms[:n])
+        columns["arms"] = _fixed_list(self._arms[:n])
+        columns["history"] = _fixed_list(self._history[:n])
+        columns["optimal"] = _fixed_list(self._optimal[:n])
+        if self.probs:
+            columns["probs"] = _fixed_list(self._probs[:n])
+
+        table = pa.table([columns[f.name] for f in self.schema], schema=self.schema)
+        self.writer.write_table(table)
+
+        self._n = 0
+        self._history[:] = -1
+        self._optimal[:] = -1
+
+    def close(self):
+        if self.writer is not None:
+            self.flush()
+            self.writer.close()
+            self.writer = None
+
+
+# Passes rows on to results in cell_id order, holding back rows that finish
+# ahead of an earlier cell (reordered plans, batches, parallel workers). Held
+# rows stay in memory: with cell_order "hint" that is nearly every row until
+# the cells of the last hint run.
+class OrderedResults:
+    def __init__(self, results, cell_ids):
+        self.results = results
+        self.expected = sorted(cell_ids)
+        self.known = set(self.expected)
+        self.pos = 0
+        self.waiting = {}
+
+    @property
+    def rows(self):
+        return self.results.rows
+
+    # a row outside the plan would wait forever and never be written, e.g. one
+    # replayed from the progress log of another shard
+    def add(self, cell_id, row):
+        if cell_id not in self.known:
+            raise ValueError(
+                f"row of cell {cell_id} is not in the plan of this run "
+                "(progress log of another shard or config?)"
+            )
+        self.waiting[cell_id] = row
+        while self.pos < len(self.expected) and self.expected[self.pos] in self.waiting:
+            self.results.add(self.waiting.pop(self.expected[self.pos]))
+            self.pos += 1
+
+
+# nested fixed-size list array from the trailing dimensions of a numpy array
+def _fixed_list(a):
+    arr = pa.array(np.ascontiguousarray(a).reshape(-1))
+    for size in reversed(a.shape[1:]):
+        arr = pa.FixedSizeListArray.from_arrays(arr, size)
+    return arr
+
+
+# writer for the results of a config; drifting means leave the integers
+def open_results(path, config):
+    integral = config["bandit"] != "drifting" and all(
+        float(m).is_integer() for a in config["arm_means"] for m in a
+    )
+    return ResultsWriter(
+        path,
+        config["narms"],
+        config.get("n_iters", N_ITERS),
+        arms_type=pa.int64() if integral else pa.float64(),
+        probs=config.get("scoring", False),
+        row_group_size=config.get("row_group_size", 128),
+    )
+
+
+# Combine shard outputs into one file in cell_id order, which is the row order
+# of an unsharded run. Every cell of plan must appear exactly once.
+def merge_results(paths, output, plan):
+    versions = {schema_version(p) for p in paths}
+    if versions != {SCHEMA_VERSION}:
+        raise ValueError(f"cannot merge: shards have schema versions {sorted(versions)}")
+    table = pa.concat_tables([pq.read_table(p) for p in paths]).unify_dictionaries()
+    ids = table.column("cell_id").to_numpy()
+
+    expected = np.sort(plan.cells["cell_id"])
+    found, counts = np.unique(ids, return_counts=True)
+    duplicated = found[counts > 1]
+    missing = np.setdiff1d(expected, found)
+    unknown = np.setdiff1d(found, expected)
+    if len(duplicated) or len(missing) or len(unknown):
+        raise ValueError(
+            f"cannot merge: {len(missing)} cells missing, {len(duplicated)} "
+            f"duplicated, {len(unknown)} not in the config "
+            f"(first: {list(missing[:5])}, {list(duplicated[:5])}, {list(unknown[:5])})"
+        )
+
+    table = table.take(np.argsort(ids, kind="stable")).combine_chunks()
+    table = table.replace_schema_metadata({VERSION_KEY: str(SCHEMA_VERSION).encode()})
+    pq.write_table(table, output)
+    return table.num_rows
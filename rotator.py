@@ -1,41 +1,70 @@
+import re
 import numpy as np
 
 
+FIELD = re.compile(r"\{(\w+)\}")
+
+
+# sorted position of every rank name a hint can refer to, for any number of
+# arms: {min}/{max}, {mid} for odd narms, and {minK}/{maxK} counting outwards
+# from the middle, so {min2}, {min1}, {mid}, {max1}, {max2} for 5 arms
+def rank_names(narms):
+    m = narms // 2
+    names = {"min": 0, "max": narms - 1}
+    if narms % 2:
+        names["mid"] = m
+    for k in range(1, m + 1):
+        names[f"min{k}"] = m - k
+        names[f"max{k}"] = narms - 1 - (m - k)
+    return names
+
+
+# hint with its rank placeholders parsed once, rendered for any arm values
+class HintTemplate:
+    def __init__(self, text, narms):
+        self.text = text
+        ranks = rank_names(narms)
+        parts = FIELD.split(text)
+
+        # literal strings, and sorted positions where a placeholder was
+        self.parts = []
+        for i, part in enumerate(parts):
+            if i % 2 == 0:
+                self.parts.append(part)
+            elif part in ranks:
+                self.parts.append(ranks[part])
+            else:
+                self.parts.append("{" + part + "}")
+
+    # (arm index, sorted position) of every arm the hint refers to
+    def mentioned_arms(self, arms):
+        sorted_indices = np.argsort(arms)
+        return [(int(sorted_indices[p]), p) for p in self.parts if not isinstance(p, str)]
+
+    def render(self, arms):
+        sorted_indices = np.argsort(arms) + 1
+        return "".join(
+            p if isinstance(p, str) else f"arm {sorted_indices[p]}" for p in self.parts
+        )
+
+
 class BanditArmsRotator:
     def __init__(self, arms, hints):
         self.arms = arms
         self.hints = hints
+        self.templates = [HintTemplate(h, len(arms)) for h in hints]
         self.current_index = 0
 
     def _rotate_right(self):
         return [self.arms[-1]] + self.arms[:-1]
 
-    def _update_hints(self, arms, hints):
-        sorted_indices = np.argsort(arms) + 1
-        updated_hints = []
-
-        if len(self.arms) == 3:
-            for hint in hints:
-                hint = hint.replace(f"{{max}}", f"arm {sorted_indices[2]}")
-                hint = hint.replace(f"{{mid}}", f"arm {sorted_indices[1]}")
-                hint = hint.replace(f"{{min}}", f"arm {sorted_indices[0]}")
-                updated_hints.append(hint)
-
-        elif len(self.arms) == 5:
-            for hint in hints:
-                hint = hint.replace(f"{{max2}}", f"arm {sorted_indices[4]}")
-                hint = hint.replace(f"{{max1}}", f"arm {sorted_indices[3]}")
-                hint = hint.replace(f"{{mid}}", f"arm {sorted_indices[2]}")
-                hint = hint.replace(f"{{min1}}", f"arm {sorted_indices[1]}")
-                hint = hint.replace(f"{{min2}}", f"arm {sorted_indices[0]}")
-
-                updated_hints.append(hint)
-        return updated_hints
+    def _update_hints(self, arms, templates):
+        return [t.render(arms) for t in templates]
 
     def next(self):
         self.arms = self._rotate_right()
         self.current_index += 1
-        new_hints = self._update_hints(self.arms, self.hints)
+        new_hints = self._update_hints(self.arms, self.templates)
 
         return self.arms, new_hints
 
@@ -58,6 +87,11 @@ def main():
     print(rotator.next())
     print(rotator.next())
 
+    arms, hints = [10, 20, 30, 40], ["{min2}, {min1}, {max1}, {max2}"]
+    rotator = BanditArmsRotator(arms, hints)
+    print(rotator.next())
+    print(rotator.next())
+
 
 if __name__ == "__main__":
     main()
@@ -1,58 +1,222 @@
+import copy
 import json
 import time
 import argparse
-from unsloth import FastLanguageModel
-from transformers import pipeline
-from transformers import AutoTokenizer, AutoModelForCausalLM
-import pandas as pd
-from rotator import BanditArmsRotator
+import numpy as np
 from bandits import stationary_MAB, drifting_MAB, stepwise_MAB, two_context_MAB
 from bandits import three_context_MAB, moving_avg_MAB, time_delayed_MAB
-from mab import MAB
-from analysis.plot import plot_results
+from bandits import stationary_BatchMAB, drifting_BatchMAB, stepwise_BatchMAB
+from bandits import moving_avg_BatchMAB, time_delayed_BatchMAB
+from mab import MAB, make_context
+from batch import run_batch, run_overlapped
+from backends import make_backend, uses_model
+from policies import simulate
+from streams import EpisodeStreams
+from trajectories import make_trajectory, trajectory_seed
+from results import open_results, OrderedResults, merge_results
+from progress import ProgressLog, progress_path, latest_progress, seed_rngs
+from planner import Plan, make_plan
+from pool import run_pool
+from adaptive import run_adaptive
+from instrument import StepRecorder, steps_path, summarize
+from analysis.manifest import register_run
+from model_cache import artifact_dir, artifact_lock, verify_artifact, save_artifact
+from config.constants import MAX_SEQ_LENGTH, N_ITERS
 
 
-def run_experiment(pipe, config):
-    results_df = pd.DataFrame(
-        columns=["bandit", "og_arms", "og_hints", "arms", "hint", "history"]
-    )
+# rows are written to results, a ResultsWriter, in cell_id order whatever order
+# the plan runs the cells in; cells already in progress, a ProgressLog, are
+# replayed from it and skipped, and new ones are recorded to it. recorder, an
+# instrument.StepRecorder, gets the cost of every step of the LLM backends.
+def run_experiment(backend, config, results, progress=None, plan=None, recorder=None):
     bandit = eval(config["bandit"] + "_MAB()")
 
     bandit.set_narms(config["narms"])
     bandit.set_stds(config["arm_stds"])
 
-    for a in config["arm_means"]:
-        rotator = BanditArmsRotator(a, config["hints"])
-
-        while rotator.current_index < bandit.narms:
-            bandit.means, rhints = rotator.next()
-            for ogh, h in zip(config["hints"], rhints):
-                for t in range(config["ntrials"]):
-                    hist = MAB(pipe, h, bandit)
-                    results_df = results_df._append(
-                        {
-                            "bandit": config["bandit"],
-                            "og_arms": a,
-                            "og_hints": ogh,
-                            "arms": bandit.means,
-                            "hint": h,
-                            "history": hist,
-                        },
-                        ignore_index=True,
-                    )
-
-    return results_df
+    if plan is None:
+        plan = make_plan(config)
+    results = OrderedResults(results, plan.cells["cell_id"].tolist())
+    if progress is not None:
+        for key, row in progress.entries():
+            results.add(plan.cell_id(key), row)
+        progress.restore_rng()
+
+    # classical agents play whole chunks of the grid at once
+    if not backend.needs_prompts:
+        _run_vectorized(backend, config, results, progress, plan)
+        return
+
+    n_iters = config.get("n_iters", N_ITERS)
+
+    # episodes waiting to be run together when batch_size > 1, or in overlapped
+    # groups of batch_size when config["overlap"] > 1 and the backend allows it
+    batch_size = config.get("batch_size", 1)
+    groups = config.get("overlap", 1) if getattr(backend, "overlap", False) else 1
+    pending = []
+
+    # draw the rewards once per (arm set, rotation, rep) and replay them for
+    # every hint, so hint conditions share the same noise
+    common_noise = config.get("common_noise", False)
+
+    for cell in plan:
+        if progress is not None and cell.key in progress:
+            continue
+
+        bandit.means = np.array(cell.arms)
+        if common_noise:
+            seed = trajectory_seed(cell.arms_idx, cell.rotation, cell.rep)
+            bandit.set_trajectory(make_trajectory(bandit, n_iters, seed))
+        row = _row(config, cell)
+
+        # batched episodes each get their own copy of the bandit
+        if batch_size > 1 or groups > 1:
+            pending.append((cell, row, copy.deepcopy(bandit)))
+            if len(pending) == batch_size * groups:
+                _run_pending(backend, pending, config, results, progress, recorder)
+                pending = []
+            continue
+
+        seed_rngs(cell.seed)
+        verbose = not config.get("quiet", False)
+        context = make_context(config, config["narms"])
+        hist, probs = MAB(backend, cell, bandit, n_iters, recorder, verbose, context)
+        _add_result(results, progress, cell, row, hist, probs, bandit)
+
+    if pending:
+        _run_pending(backend, pending, config, results, progress, recorder)
+
+
+# a resumed run has to show the trial history the way the logged rows did,
+# or one results file would mix context policies
+def _check_resume(progress, config):
+    context = make_context(config, config["narms"]).name
+    logged = {row.get("context", "full") for _, row in progress.entries()}
+    if logged != {context}:
+        raise ValueError(
+            f"cannot resume with context {context!r}: the log was run with "
+            f"{sorted(logged)}"
+        )
+
+
+# result row of cell, without the outcome of the episode (see _add_result)
+def _row(config, cell):
+    return {
+        "cell_id": cell.cell_id,
+        "arms_idx": cell.arms_idx,
+        "rotation": cell.rotation,
+        "hint_idx": cell.hint_idx,
+        "rep": cell.rep,
+        "bandit": config["bandit"],
+        "og_arms": cell.og_arms,
+        "og_hints": cell.og_hint,
+        "hint": cell.hint,
+        # how the trial history was shown, see mab.TrialContext
+        "context": make_context(config, config["narms"]).name,
+    }
+
+
+# the outcome of an episode played against bandit: the arm means it ended
+# with, as the rows always recorded them, and the best arm of every step
+def _add_result(results, progress, cell, row, hist, probs, bandit):
+    row["arms"] = np.array(bandit.means).tolist()
+    row["optimal"] = bandit.optimal_path
+    row["history"] = hist
+    # per-step arm probabilities, T x narms
+    row["probs"] = probs
+    results.add(cell.cell_id, row)
+    if progress is not None:
+        progress.record(cell.key, row, rng=True)
+
+
+# run the queued episodes in lockstep, in overlapped groups of batch_size when
+# there are more. The environment of every episode is seeded from its own cell
+# (see batch._Group); only the model's sampling, one stream for the whole
+# batch, is seeded from its first cell.
+def _run_pending(backend, pending, config, results, progress, recorder):
+    seed_rngs(pending[0][0].seed)
+    episodes = [(c, b) for c, _, b in pending]
+    batch_size = config.get("batch_size", 1)
+    if len(episodes) > batch_size:
+        groups = [episodes[i : i + batch_size] for i in range(0, len(episodes), batch_size)]
+        depth = config.get("overlap_depth", 2)
+        outputs = sum(run_overlapped(backend, groups, config, recorder, depth), [])
+    else:
+        outputs = run_batch(backend, episodes, config, recorder)
+    for (cell, row, bandit), (hist, probs) in zip(pending, outputs):
+        _add_result(results, progress, cell, row, hist, probs, bandit)
+
+
+# Play the plan with a vectorized agent (policies.py) against the batched
+# bandits, policy_batch cells at a time, every episode drawing from streams
+# seeded by its own cell, so the results do not depend on policy_batch or
+# resuming. Finished cells are skipped but not logged to progress, since
+# re-running them costs less than logging them.
+def _run_vectorized(agent, config, results, progress, plan):
+    n_iters = config.get("n_iters", N_ITERS)
+    todo = np.arange(len(plan))
+    if progress is not None and len(progress):
+        todo = np.array([i for i in todo if plan[i].key not in progress], dtype=np.int64)
 
+    size = config.get("policy_batch", 65536)
+    for start in range(0, len(todo), size):
+        cells = list(plan.subset(todo[start : start + size]))
+        seeds = [c.seed for c in cells]
+        bandit = eval(config["bandit"] + "_BatchMAB()")
+        bandit.set_rng(EpisodeStreams(seeds))
+        bandit.set_narms(config["narms"])
+        bandit.set_means([c.arms for c in cells])
+        bandit.set_stds(config["arm_stds"])
+        agent.seed_episodes(seeds)
 
+        hists = simulate(agent, bandit, cells, n_iters)
+        optimal = bandit.optimal_matrix()
+        for i, (cell, hist) in enumerate(zip(cells, hists)):
+            row = _row(config, cell)
+            row["arms"] = bandit.means[i]
+            row["optimal"] = optimal[i]
+            row["history"] = hist
+            row["probs"] = None
+            results.add(cell.cell_id, row)
+
+
+# Load the model from its quantized copy in the local artifact cache (see
+# model_cache.py), downloading and quantizing it only when there is no valid
+# copy, or when config sets force_download. unsloth and transformers are only
+# imported here, so runs without a model start without them.
 def load_model(config):
-    model, tokenizer = FastLanguageModel.from_pretrained(
-        model_name=config["model_name"],
-        max_seq_length=4096,
-        # max_seq_length=32768,
-        dtype=None,
-        load_in_4bit=True,
-        force_download=True,
-    )
+    # unsloth has to be imported before transformers to patch it
+    from unsloth import FastLanguageModel
+    from transformers import pipeline
+
+    def from_pretrained(name, force_download=False):
+        return FastLanguageModel.from_pretrained(
+            model_name=name,
+            max_seq_length=MAX_SEQ_LENGTH,
+            # max_seq_length=32768,
+            dtype=None,
+            load_in_4bit=True,
+            force_download=force_download,
+        )
+
+    path = artifact_dir(config, MAX_SEQ_LENGTH)
+    force = config.get("force_download", False)
+
+    def missing():
+        return force or not verify_artifact(
+            path, config["model_name"], full=config.get("verify_model_cache", False)
+        )
+
+    # only filling the cache holds the lock, so warm loads run side by side;
+    # checked again under it, another worker may have just filled it
+    model = None
+    if missing():
+        with artifact_lock(path):
+            if missing():
+                model, tokenizer = from_pretrained(config["model_name"], force)
+                save_artifact(model, tokenizer, path, config["model_name"])
+    if model is None:
+        model, tokenizer = from_pretrained(path)
     FastLanguageModel.for_inference(model)
 
     # model, tokenizer = AutoModelForCausalLM.from_pretrained(config["model_name"]), AutoTokenizer.from_pretrained(config["model_name"])
@@ -73,20 +237,125 @@ def load_model(config):
 def run_exp():
     parser = argparse.ArgumentParser()
     parser.add_argument("--config-file", type=str, default="config/stationary.json")
+    parser.add_argument("--output", type=str, default=None)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes, each loading its own model",
+    )
+    parser.add_argument("--shard-index", type=int, default=0)
+    parser.add_argument(
+        "--num-shards",
+        type=int,
+        default=1,
+        help="run only the cells of shard --shard-index out of --num-shards",
+    )
+    parser.add_argument(
+        "--merge",
+        nargs="+",
+        default=None,
+        help="combine these shard outputs into --output instead of running",
+    )
+    parser.add_argument(
+        "--instrument",
+        action="store_true",
+        help="record per-step prompt size and timings to <output>.steps.<session>.parquet",
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="do not print every trial"
+    )
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=None,
+        help="send inference to the server.py daemon on this Unix socket",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the run in --output (default: the latest unfinished run of "
+        "this bandit type), skipping episodes that already finished",
+    )
     args = parser.parse_args()
 
     with open(args.config_file, "r") as f:
         config = json.load(f)
+    if args.quiet:
+        config["quiet"] = True
+    if args.server:
+        config["server"] = args.server
 
-    _, _, pipe = load_model(config)
-    results_df = run_experiment(pipe, config)
+    if args.merge:
+        output = args.output or config["bandit"] + f"_{time.strftime('%Y%m%d-%H%M%S')}.parquet"
+        rows = merge_results(args.merge, output, Plan(config))
+        register_run(output, config, rows, args.config_file)
+        print(f"Merged {len(args.merge)} shards, {rows} rows into {output}")
+        return
 
-    results_df.to_parquet(
-        config["bandit"] + f"_{time.strftime('%Y%m%d-%H%M%S')}.parquet",
-        engine="pyarrow",
-        index=False,
-    )
-    print(results_df)
+    if "adaptive" in config and (args.workers > 1 or args.num_shards > 1):
+        raise ValueError("adaptive runs choose each round from the last one, on one process")
+
+    plan = make_plan(config)
+    shard = ""
+    if args.num_shards > 1:
+        plan = plan.shard(args.shard_index, args.num_shards)
+        shard = f"_shard{args.shard_index}-of-{args.num_shards}"
+
+    output = args.output
+    if output is None and args.resume:
+        log = latest_progress(config["bandit"], shard)
+        if log is not None:
+            output = log[: -len(".progress.jsonl")]
+    if output is None:
+        output = config["bandit"] + shard + f"_{time.strftime('%Y%m%d-%H%M%S')}.parquet"
+
+    progress = ProgressLog(progress_path(output), resume=args.resume)
+    if len(progress):
+        _check_resume(progress, config)
+        print(f"Resuming {output}: {len(progress)} episodes already done")
+
+    # rows are flushed to the parquet file a row group at a time; closing the
+    # writer on the way out keeps everything written before a failure readable.
+    # The parquet file is rewritten on resume, starting from the logged rows.
+    # step records go to a new file per session, so a resumed run keeps the
+    # records of the sessions before it
+    if args.instrument:
+        config["instrument"] = True
+        config["output"] = output
+        config["steps_session"] = time.strftime("%Y%m%d-%H%M%S")
+
+    recorder = None
+    summary = None
+    with open_results(output, config) as results:
+        if args.workers > 1:
+            step_totals = run_pool(config, results, progress, plan, args.workers)
+            if args.instrument:
+                summary = summarize(step_totals)
+        else:
+            pipe = load_model(config)[2] if uses_model(config) else None
+            backend = make_backend(config, pipe)
+            if args.instrument:
+                recorder = StepRecorder(
+                    steps_path(output, config["steps_session"]),
+                    getattr(backend, "count_tokens", None),
+                )
+            try:
+                if "adaptive" in config:
+                    scheduler = run_adaptive(backend, config, results, progress, recorder)
+                    print(scheduler.summary())
+                else:
+                    run_experiment(backend, config, results, progress, plan, recorder)
+            finally:
+                if recorder is not None:
+                    recorder.close()
+                    summary = recorder.summary()
+    progress.remove()
+    register_run(output, config, results.rows, args.config_file, shard.lstrip("_"))
+    print(f"Wrote {results.rows} rows to {output}")
+    if summary is not None:
+        print(summary)
+    # from analysis.plot import plot_results
     # plot_results(args.config_file, config["bandit"] + f'_{time.strftime("%Y%m%d-%H%M%S")}.parquet')
 
 
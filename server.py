@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import socket
+import struct
+import argparse
+import threading
+import numpy as np
+from collections import deque
+
+
+# Wire format between RemoteBackend (backends.py) and the server: every message
+# is a 4-byte big-endian length followed by that many bytes of JSON. A client
+# first sends {"hello": model_name} and gets back {"model_name": name} if the
+# server runs that model, else {"error": text}. Then it sends {"prompts": [...],
+# "seeds": [...], "narms": n, "temperature": t, "scoring": bool}, one seed (a
+# list of ints) per prompt, and gets back {"choices": [...], "probs": [[...]]
+# or null} or {"error": text}.
+def send_message(sock, message):
+    data = json.dumps(message).encode()
+    sock.sendall(struct.pack(">I", len(data)) + data)
+
+
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        buf += chunk
+    return bytes(buf)
+
+
+def recv_message(sock):
+    (n,) = struct.unpack(">I", _recv_exact(sock, 4))
+    return json.loads(_recv_exact(sock, n))
+
+
+# The model side of the server: one call for the prompts of many requests that
+# share narms, temperature and scoring; returns (choices, probs or None). With
+# scoring every answer is drawn from the arm probabilities with its prompt's
+# seed, so it does not depend on the other prompts of the batch. Generated
+# answers come from one torch stream per batch, seeded by its first prompt.
+# Every prompt is prefilled in full: the server keeps no KV cache between
+# requests.
+class PipeEngine:
+    def __init__(self, pipe, config):
+        self.pipe = pipe
+        self.config = config
+
+    def choose(self, prompts, seeds, narms, temperature, scoring):
+        import torch
+        from batch import choose_batch, max_batch_tokens
+
+        ids = [self.pipe.tokenizer(p)["input_ids"] for p in prompts]
+        max_tokens = max_batch_tokens(self.config, len(ids))
+        torch.manual_seed(int(np.random.SeedSequence(seeds[0]).generate_state(1)[0]))
+        choices, probs = choose_batch(self.pipe, ids, narms, temperature, scoring, max_tokens)
+        if not scoring:
+            return choices, None
+        return [_draw(seed, p) for seed, p in zip(seeds, probs)], probs
+
+
+# 1-based arm drawn from probabilities p with a generator seeded by seed
+def _draw(seed, p):
+    p = np.asarray(p, dtype=np.float64)
+    return int(np.random.default_rng(seed).choice(len(p), p=p / p.sum())) + 1
+
+
+# FakeBackend behind the engine interface, to run the server without a GPU
+class FakeEngine:
+    def __init__(self, **kwargs):
+        from backends import FakeBackend
+
+        self.backend = FakeBackend(**kwargs)
+
+    def choose(self, prompts, seeds, narms, temperature, scoring):
+        self.backend.seed(seeds[0])
+        self.backend.narms = narms
+        self.backend.last = [[] for _ in prompts]
+        return self.backend.choose(prompts)
+
+
+class _Request:
+    def __init__(self, client, message):
+        self.client = client
+        self.message = message
+        self.key = (message["narms"], message["temperature"], message["scoring"])
+        self.reply = None
+        self.done = threading.Event()
+
+
+# Serves one engine to any number of clients on a Unix socket. A client is
+# only served if it asks for the server's model_name. Every client
+# connection has its own thread and request queue; one scheduler thread runs
+# the engine. After the first request arrives it waits up to max_wait seconds
+# for more, then takes whole requests from the client queues in round-robin
+# order, up to max_batch prompts, so that a client with a large grid cannot
+# starve a small one. Requests are coalesced only when they share narms,
+# temperature and scoring.
+class InferenceServer:
+    def __init__(self, engine, path, model_name, max_batch=64, max_wait=0.005):
+        self.engine = engine
+        self.path = path
+        self.model_name = model_name
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queues = {}
+        self.order = deque()
+        self.lock = threading.Condition()
+        self.running = True
+        self.batches = 0
+        self.prompts = 0
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        self.sock.listen()
+        threading.Thread(target=self._schedule, daemon=True).start()
+        print(f"Serving on {self.path}")
+        try:
+            client = 0
+            while self.running:
+                conn, _ = self.sock.accept()
+                threading.Thread(
+                    target=self._handle, args=(client, conn), daemon=True
+                ).start()
+                client += 1
+        finally:
+            self.close()
+
+    def close(self):
+        self.running = False
+        with self.lock:
+            self.lock.notify_all()
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    # whether the client asks for the model this server runs
+    def _hello(self, conn):
+        try:
+            message = recv_message(conn)
+        except ConnectionError:
+            return False
+        if message.get("hello") != self.model_name:
+            send_message(
+                conn,
+                {"error": f"server runs {self.model_name}, not {message.get('hello')}"},
+            )
+            return False
+        send_message(conn, {"model_name": self.model_name})
+        return True
+
+    # read requests of one client, one at a time, and send back the replies
+    def _handle(self, client, conn):
+        if not self._hello(conn):
+            conn.close()
+            return
+        with self.lock:
+            self.queues[client] = deque()
+            self.order.append(client)
+        try:
+            while self.running:
+                try:
+                    message = recv_message(conn)
+                except ConnectionError:
+                    break
+                request = _Request(client, message)
+                with self.lock:
+                    self.queues[client].append(request)
+                    self.lock.notify_all()
+                request.done.wait()
+                send_message(conn, request.reply)
+        finally:
+            conn.close()
+            with self.lock:
+                del self.queues[client]
+                self.order.remove(client)
+
+    # next batch of requests, taking the head request of each client in turn
+    def _take(self):
+        batch, size, key = [], 0, None
+        progress = True
+        while progress:
+            progress = False
+            for _ in range(len(self.order)):
+                client = self.order[0]
+                self.order.rotate(-1)
+                queue = self.queues[client]
+                if not queue:
+                    continue
+                request = queue[0]
+                n = len(request.message["prompts"])
+                if key is not None and (request.key != key or size + n > self.max_batch):
+                    continue
+                queue.popleft()
+                batch.append(request)
+                size += n
+                key = request.key
+                progress = True
+        # start from the next client next time
+        self.order.rotate(-1)
+        return batch
+
+    def _schedule(self):
+        while self.running:
+            with self.lock:
+                while self.running and not any(self.queues.values()):
+                    self.lock.wait()
+                if not self.running:
+                    return
+            # give other clients a moment to send their step too
+            time.sleep(self.max_wait)
+            with self.lock:
+                batch = self._take()
+
+            prompts = [p for r in batch for p in r.message["prompts"]]
+            seeds = [seed for r in batch for seed in r.message["seeds"]]
+            try:
+                choices, probs = self.engine.choose(prompts, seeds, *batch[0].key)
+                start = 0
+                for r in batch:
+                    end = start + len(r.message["prompts"])
+                    r.reply = {"choices": choices[start:end], "probs": None}
+                    if probs is not None:
+                        r.reply["probs"] = [list(p) for p in probs[start:end]]
+                    start = end
+            except Exception as e:
+                for r in batch:
+                    r.reply = {"error": f"{type(e).__name__}: {e}"}
+            self.batches += 1
+            self.prompts += len(prompts)
+            for r in batch:
+                r.done.set()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config-file", type=str, default="config/stationary.json")
+    parser.add_argument("--socket", type=str, default="/tmp/su_ibt.sock")
+    parser.add_argument(
+        "--fake", action="store_true", help="serve FakeBackend instead of the model"
+    )
+    parser.add_argument(
+        "--max-batch", type=int, default=64, help="prompts per forward pass"
+    )
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=5.0,
+        help="how long to wait for other clients before running a batch",
+    )
+    args = parser.parse_args()
+
+    with open(args.config_file, "r") as f:
+        config = json.load(f)
+
+    if args.fake:
+        engine = FakeEngine(**config.get("agent", {}))
+    else:
+        from run import load_model
+
+        engine = PipeEngine(load_model(config)[2], config)
+    server = InferenceServer(
+        engine, args.socket, config["model_name"], args.max_batch, args.max_wait_ms / 1000
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"{server.batches} batches, {server.prompts} prompts")
+
+
+if __name__ == "__main__":
+    main()
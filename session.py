@@ -0,0 +1,145 @@
+import torch
+from transformers import DynamicCache
+
+
+# token ids of the arm labels "1".."narms", which must each be one token
+def arm_token_ids(tokenizer, narms):
+    ids = []
+    for i in range(1, narms + 1):
+        tokens = tokenizer.encode(str(i), add_special_tokens=False)
+        if len(tokens) != 1:
+            raise ValueError(f"arm label {i} is not a single token")
+        ids.append(tokens[0])
+    return ids
+
+
+# sample one arm per row from logits restricted to the arm labels (B x narms),
+# returns the 1-based choices and the renormalized probabilities
+def sample_arms(logits, temperature):
+    logits = logits.float()
+    if temperature > 0:
+        probs = torch.softmax(logits / temperature, dim=-1)
+        choices = torch.multinomial(probs, 1)[:, 0] + 1
+    else:
+        choices = torch.argmax(logits, dim=-1) + 1
+        probs = torch.nn.functional.one_hot(choices - 1, logits.shape[-1]).float()
+    return choices.tolist(), probs
+
+
+# Keeps the KV cache of the prompt seen so far, so that each step only has to
+# prefill the tokens that changed since the previous step
+class EpisodeSession:
+    def __init__(self, model, tokenizer, temperature, prefix_cache=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.temperature = temperature
+        self.prefix_cache = prefix_cache
+        self.cache = DynamicCache()
+        self.ids = []
+
+    def reset(self):
+        self.cache = DynamicCache()
+        self.ids = []
+
+    # number of leading tokens shared by the cache and the new prompt
+    def _common_prefix(self, ids):
+        n = 0
+        for a, b in zip(self.ids, ids):
+            if a != b:
+                break
+            n += 1
+        return n
+
+    # drop everything in the cache after the first n tokens
+    def _crop(self, n):
+        if n < len(self.ids):
+            self.cache.crop(n)
+            self.ids = self.ids[:n]
+
+    # reuse as much of ids as is already computed, either in the current cache
+    # or in a shared prefix, and crop the cache to that point
+    def _restore(self, ids, limit):
+        n = self._common_prefix(ids)
+        if self.prefix_cache is not None:
+            m = self.prefix_cache.lookup(ids[:limit])
+            if m > n:
+                self.cache = self.prefix_cache.fork(ids[:m])
+                self.ids = ids[:m]
+                n = m
+            else:
+                self.prefix_cache.misses += 1
+        self._crop(min(n, limit))
+
+    # compute and keep the KV state of text, storing it as a shared prefix
+    def prefill(self, text):
+        ids = self.tokenizer(text)["input_ids"]
+        self._restore(ids, len(ids))
+
+        if len(self.ids) < len(ids):
+            new_ids = torch.tensor([ids[len(self.ids) :]], device=self.model.device)
+            with torch.no_grad():
+                out = self.model(
+                    input_ids=new_ids, past_key_values=self.cache, use_cache=True
+                )
+            self.cache = out.past_key_values
+            self.ids = ids
+
+        if self.prefix_cache is not None:
+            self.prefix_cache.insert(ids, self.cache)
+
+    # one forward pass over the uncached part of the prompt, then sample the arm
+    # from the next-token distribution restricted to the arm labels. Returns the
+    # 1-based choice and the per-arm probabilities.
+    def score(self, prompt, narms):
+        ids = self.tokenizer(prompt)["input_ids"]
+        self._restore(ids, len(ids) - 1)
+
+        new_ids = torch.tensor([ids[len(self.ids) :]], device=self.model.device)
+        with torch.no_grad():
+            out = self.model(
+                input_ids=new_ids, past_key_values=self.cache, use_cache=True
+            )
+        self.cache = out.past_key_values
+        self.ids = ids
+
+        arm_ids = arm_token_ids(self.tokenizer, narms)
+        choices, probs = sample_arms(out.logits[:, -1, arm_ids], self.temperature)
+        return int(choices[0]), probs[0].tolist()
+
+    # same result as pipe(prompt)[0]["generated_text"][len(prompt):] but only
+    # the tokens not already in the cache go through the model
+    def generate(self, prompt):
+        ids = self.tokenizer(prompt)["input_ids"]
+
+        # keep at least one token to feed so generate has logits to sample from
+        self._restore(ids, len(ids) - 1)
+
+        input_ids = torch.tensor([ids], device=self.model.device)
+        with torch.no_grad():
+            out = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=self.cache,
+                pad_token_id=0,
+                # temperature 0 decodes greedily, as sample_arms does
+                do_sample=self.temperature > 0,
+                temperature=self.temperature or None,
+                max_new_tokens=1,
+            )
+
+        # generate leaves the prompt in the cache, the sampled token is not fed back
+        self.ids = ids
+        self._crop(len(ids))
+
+        # decode the same way the text-generation pipeline does
+        prompt_length = len(
+            self.tokenizer.decode(
+                out[0][: len(ids)],
+                skip_special_tokens=True,
+                clean_up_tokenization_spaces=True,
+            )
+        )
+        text = self.tokenizer.decode(
+            out[0], skip_special_tokens=True, clean_up_tokenization_spaces=True
+        )
+        return text[prompt_length:]
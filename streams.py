@@ -0,0 +1,59 @@
+import numpy as np
+
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_M1 = np.uint64(0xBF58476D1CE4E5B9)
+_M2 = np.uint64(0x94D049BB133111EB)
+
+
+# splitmix64 finalizer, elementwise on uint64 arrays (multiplication wraps)
+def mix64(x):
+    x = np.asarray(x, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        x = (x ^ (x >> np.uint64(30))) * _M1
+        x = (x ^ (x >> np.uint64(27))) * _M2
+    return x ^ (x >> np.uint64(31))
+
+
+# uint64 hash of integer columns of one length, elementwise
+def hash_ints(*columns):
+    h = np.zeros(np.shape(columns[0]), dtype=np.uint64)
+    for c in columns:
+        with np.errstate(over="ignore"):
+            h = mix64(h ^ (np.asarray(c).astype(np.uint64) + _GOLDEN))
+    return h
+
+
+# Independent random streams of E episodes behind the vectorized Generator
+# calls the batched bandits and agents (policies.py) make, so that every
+# episode draws the same numbers whichever episodes it is stepped with. The
+# draws are counter-based: the n-th call's value j of an episode is a hash of
+# (seed, stream, n, j), seed being that of its cell, so a whole batch is drawn
+# with a few array operations and no generator per episode. The first
+# dimension of every shape is E.
+class EpisodeStreams:
+    def __init__(self, seeds, stream=0):
+        self.keys = hash_ints(np.asarray(seeds), np.full(len(seeds), stream))
+        self.calls = 0
+
+    # uniforms in [0, 1) of shape
+    def _uniform(self, shape):
+        shape = tuple(int(n) for n in np.atleast_1d(shape))
+        width = int(np.prod(shape[1:], dtype=np.int64))
+        counter = hash_ints(np.full(width, self.calls), np.arange(width))
+        self.calls += 1
+        with np.errstate(over="ignore"):
+            x = mix64(self.keys[:, None] + counter[None, :])
+        return ((x >> np.uint64(11)) * 2.0**-53).reshape(shape)
+
+    def random(self, shape):
+        return self._uniform(shape)
+
+    # Box-Muller on two uniforms, the first moved to (0, 1] for the log
+    def standard_normal(self, shape):
+        u1 = 1.0 - self._uniform(shape)
+        u2 = self._uniform(shape)
+        return np.sqrt(-2.0 * np.log(u1)) * np.cos(2 * np.pi * u2)
+
+    def normal(self, loc, scale, shape):
+        return loc + scale * self.standard_normal(shape)
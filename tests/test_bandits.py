@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+import bandits
+from streams import EpisodeStreams
+
+
+MEANS = [[10, 20, 30, 40, 50], [50, 40, 30, 20, 10], [30, 50, 10, 40, 20]]
+STDS = [4, 4, 4, 4, 4]
+SEEDS = [11, 22, 33]
+STEPS = 25
+
+
+# One episode of EpisodeStreams behind the np.random calls of a scalar bandit,
+# so it draws what its row of a batched bandit draws
+class _Row:
+    def __init__(self, seed):
+        self.streams = EpisodeStreams([seed])
+
+    def normal(self, loc, scale, size):
+        return self.streams.normal(loc, scale, (1, size))[0]
+
+
+def _actions(step):
+    return [(step + i) % len(STDS) for i in range(len(SEEDS))]
+
+
+@pytest.mark.parametrize(
+    "name", ["stationary", "drifting", "stepwise", "moving_avg", "time_delayed"]
+)
+def test_batched_matches_scalar(name):
+    batch = getattr(bandits, name + "_BatchMAB")()
+    batch.set_narms(len(STDS))
+    batch.set_means(MEANS)
+    batch.set_stds(STDS)
+    batch.set_rng(EpisodeStreams(SEEDS))
+    batch.reset()
+    rewards = np.array([batch.step(_actions(t)) for t in range(STEPS)]).T
+
+    for i, seed in enumerate(SEEDS):
+        bandit = getattr(bandits, name + "_MAB")()
+        bandit.set_narms(len(STDS))
+        bandit.set_means(MEANS[i])
+        bandit.set_stds(STDS)
+        bandit.set_rng(_Row(seed))
+        bandit.reset()
+        scalar = [bandit.get_reward(_actions(t)[i]) for t in range(STEPS)]
+        np.testing.assert_allclose(rewards[i], scalar)
+        np.testing.assert_allclose(batch.means[i], bandit.means)
+        assert batch.optimal_matrix()[i].tolist() == bandit.optimal_path
+
+
+# an episode draws the same numbers whichever episodes it is stepped with
+def test_streams_independent_of_batch():
+    together = EpisodeStreams(SEEDS)
+    alone = EpisodeStreams(SEEDS[1:2])
+    for shape in [(3,), (3, 5), (3, 2, 4)]:
+        np.testing.assert_array_equal(
+            together.standard_normal(shape)[1], alone.standard_normal((1,) + shape[1:])[0]
+        )
+    assert not np.array_equal(together.random((3, 8))[0], together.random((3, 8))[0])
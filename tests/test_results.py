@@ -0,0 +1,71 @@
+import os
+import json
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+from planner import Plan
+from results import SCHEMA_VERSION, schema_version, open_results, merge_results
+from run import _row as run_row
+
+
+CONFIG = os.path.join(os.path.dirname(__file__), "..", "config", "stationary.json")
+
+
+@pytest.fixture
+def config():
+    with open(CONFIG, "r") as f:
+        config = json.load(f)
+    config["ntrials"] = 2
+    config["n_iters"] = 3
+    return config
+
+
+# the row run.py writes, with a made-up episode outcome
+def _row(config, cell):
+    row = run_row(config, cell)
+    row["arms"] = cell.arms
+    row["history"] = [cell.cell_id % config["narms"] + 1, None, 1]
+    row["optimal"] = [1, 1, 1]
+    return row
+
+
+def _write_shards(config, tmp_path, num):
+    plan = Plan(config)
+    paths = []
+    for i in range(num):
+        path = str(tmp_path / f"shard{i}.parquet")
+        with open_results(path, config) as results:
+            for cell in plan.shard(i, num):
+                results.add(_row(config, cell))
+        paths.append(path)
+    return plan, paths
+
+
+def test_merge_round_trip(config, tmp_path):
+    plan, paths = _write_shards(config, tmp_path, 3)
+    assert all(schema_version(p) == SCHEMA_VERSION for p in paths)
+
+    output = str(tmp_path / "merged.parquet")
+    assert merge_results(paths, output, plan) == len(plan)
+    assert schema_version(output) == SCHEMA_VERSION
+
+    table = pq.read_table(output)
+    ids = table.column("cell_id").to_numpy()
+    assert (ids == np.arange(len(plan))).all()
+    history = table.column("history").to_pylist()
+    assert history[0] == [1, -1, 1]
+    assert table.column("hint_idx").to_pylist()[: config["ntrials"]] == [0] * config["ntrials"]
+
+
+def test_merge_rejects_missing_cells(config, tmp_path):
+    plan, paths = _write_shards(config, tmp_path, 2)
+    with pytest.raises(ValueError, match="missing"):
+        merge_results(paths[:1], str(tmp_path / "merged.parquet"), plan)
+
+
+def test_schema_version_defaults_to_1(tmp_path):
+    import pyarrow as pa
+
+    path = str(tmp_path / "old.parquet")
+    pq.write_table(pa.table({"history": [[1, None]]}), path)
+    assert schema_version(path) == 1
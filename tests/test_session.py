@@ -0,0 +1,113 @@
+import os
+import json
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+tokenizers = pytest.importorskip("tokenizers")
+
+from planner import Plan
+from mab import MAB, make_context
+from bandits import stationary_MAB
+from backends import FakeBackend, SessionBackend, make_backend
+
+
+CONFIG = os.path.join(os.path.dirname(__file__), "..", "config", "stationary.json")
+
+
+@pytest.fixture
+def config():
+    with open(CONFIG, "r") as f:
+        config = json.load(f)
+    config["ntrials"] = 2
+    config["n_iters"] = 4
+    return config
+
+
+# collects the prompt of every step in place of an instrument.StepRecorder
+class _Prompts:
+    def __init__(self):
+        self.prompts = []
+
+    def record(self, cell, step, prompt, inference_s, invalid, reward_s):
+        self.prompts.append(prompt)
+
+
+# (cell, prompts of its steps) of two reps with one hint and one with
+# another, played against FakeBackend
+def _episodes(config):
+    plan = Plan(config)
+    episodes = []
+    for cell in [plan[0], plan[1], plan[config["ntrials"]]]:
+        bandit = stationary_MAB()
+        bandit.set_narms(config["narms"])
+        bandit.set_stds(config["arm_stds"])
+        bandit.means = np.array(cell.arms)
+        recorder = _Prompts()
+        context = make_context(config, config["narms"])
+        MAB(FakeBackend(), cell, bandit, config["n_iters"], recorder, False, context)
+        episodes.append((cell, recorder.prompts))
+    return episodes
+
+
+# word-level tokenizer over the words of texts, with the arm labels
+def _tokenizer(texts):
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+
+    split = pre_tokenizers.Whitespace()
+    vocab = {"[PAD]": 0, "[UNK]": 1}
+    for text in texts + [" ".join(str(i) for i in range(10))]:
+        for word, _ in split.pre_tokenize_str(text):
+            vocab.setdefault(word, len(vocab))
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = split
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        pad_token="[PAD]",
+        unk_token="[UNK]",
+        clean_up_tokenization_spaces=True,
+    )
+
+
+# a small randomly initialized GPT-2, in float64 so the cached and uncached
+# forward passes agree on the greedy token
+def _model(tokenizer, positions):
+    from transformers import GPT2Config, GPT2LMHeadModel
+
+    torch.manual_seed(0)
+    config = GPT2Config(
+        vocab_size=len(tokenizer), n_positions=positions, n_embd=32, n_layer=2, n_head=2
+    )
+    return GPT2LMHeadModel(config).double().eval()
+
+
+@pytest.mark.parametrize("prefix_cache_mb", [None, 64])
+def test_session_matches_pipe_greedy(config, prefix_cache_mb):
+    from transformers import pipeline
+
+    episodes = _episodes(config)
+    prompts = [p for _, steps in episodes for p in steps]
+    tokenizer = _tokenizer(prompts)
+    positions = max(len(tokenizer(p)["input_ids"]) for p in prompts) + 8
+    pipe = pipeline(
+        "text-generation",
+        model=_model(tokenizer, positions),
+        tokenizer=tokenizer,
+        pad_token_id=0,
+        do_sample=False,
+        max_new_tokens=1,
+    )
+
+    config = dict(config, temperature=0.0, kv_cache=True)
+    if prefix_cache_mb is not None:
+        config["prefix_cache_mb"] = prefix_cache_mb
+    backend = make_backend(config, pipe)
+    assert isinstance(backend, SessionBackend)
+
+    for cell, steps in episodes:
+        backend.reset([cell])
+        for prompt in steps:
+            expected = pipe(prompt)[0]["generated_text"][len(prompt) :]
+            assert backend.session.generate(prompt) == expected
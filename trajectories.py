@@ -0,0 +1,38 @@
+import numpy as np
+from config.constants import SEED
+
+
+# Precomputed reward draws for one episode: rewards[t, a] is the reward arm a
+# would pay on step t, means[t] is the arm means on step t. Drawn once per
+# (arm set, rotation, rep) and replayed for every hint, so that hint conditions
+# see the same noise (common random numbers).
+class Trajectory:
+    def __init__(self, rewards, means, seed):
+        self.rewards = rewards
+        self.means = means
+        self.seed = seed
+
+    def __len__(self):
+        return len(self.rewards)
+
+
+# deterministic seed of a (arm set, rotation, rep) cell, independent of the hint
+def trajectory_seed(arms_idx, rotation_idx, rep):
+    return np.random.SeedSequence([SEED, arms_idx, rotation_idx, rep])
+
+
+# draw the mean path and rewards of T steps for the current means of bandit.
+# Stored as float32, with constant mean paths kept as a broadcast single row.
+def make_trajectory(bandit, T, seed):
+    rng = np.random.default_rng(seed)
+    means = bandit.mean_path(T, rng)
+    noise = rng.standard_normal((T, bandit.narms))
+    rewards = (means + np.asarray(bandit.stds, dtype=float) * noise).astype(np.float32)
+
+    if means.strides[0] == 0:
+        means = np.broadcast_to(means[0].astype(np.float32), means.shape)
+    else:
+        means = means.astype(np.float32)
+
+    return Trajectory(rewards, means, seed)
+